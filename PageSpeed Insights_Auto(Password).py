@@ -5,11 +5,13 @@
 
 
 import streamlit as st
-import pandas as pd
-import requests
 import time
-from io import BytesIO
 import hashlib
+from pagespeed_api import get_pagespeed_insights
+from pagespeed_batch import TokenBucket, run_batch, with_retries
+from results_buffer import ResultBuffer, RefreshThrottle, format_eta
+from score_history import ScoreHistory
+from app_common import download_results, get_session_store, get_workbook_cache, session_key
 
 # 設定密碼（這裡使用雜湊值以增加安全性）
 CORRECT_PASSWORD_HASH = "70eded5c719db84ae23a66c1dde35dff5836eabf"  # password123 的 SHA-1 雜湊值
@@ -49,31 +51,6 @@ def check_password():
     
     return True
 
-def get_pagespeed_insights(url, api_key):
-    """獲取 PageSpeed Insights 數據"""
-    api_url = 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed'
-    params = {
-        'url': url,
-        'key': api_key,
-        'strategy': 'mobile',
-        'category': ['accessibility', 'best-practices', 'performance', 'seo']
-    }
-    
-    try:
-        response = requests.get(api_url, params=params)
-        result = response.json()
-        
-        return {
-            'url': url,
-            'performance': result['lighthouseResult']['categories']['performance']['score'] * 100,
-            'accessibility': result['lighthouseResult']['categories']['accessibility']['score'] * 100,
-            'best_practices': result['lighthouseResult']['categories']['best-practices']['score'] * 100,
-            'seo': result['lighthouseResult']['categories']['seo']['score'] * 100
-        }
-    except Exception as e:
-        st.error(f"分析 {url} 時發生錯誤: {str(e)}")
-        return None
-
 def main():
     st.set_page_config(page_title="PageSpeed Insights 自動查詢工具", layout="wide")
     
@@ -83,9 +60,8 @@ def main():
     if not check_password():
         return
     
-    # 初始化 session state
-    if 'results' not in st.session_state:
-        st.session_state.results = None
+    # 初始化 session state（結果表存在共用儲存，閒置過久會被清除）
+    get_session_store().touch(session_key())
     if 'analysis_complete' not in st.session_state:
         st.session_state.analysis_complete = False
     if 'sheet_names' not in st.session_state:
@@ -96,6 +72,13 @@ def main():
                            type="password",
                            help="如果沒有 API Key，請前往 https://developers.google.com/speed/docs/insights/v5/get-started?hl=zh-tw 取得")
     
+    # 並行與限速設定
+    col1, col2 = st.columns(2)
+    max_workers = col1.number_input("同時查詢數量", min_value=1, max_value=16, value=4,
+                                    help="同時進行中的 API 請求數量")
+    rate_per_minute = col2.number_input("每分鐘請求上限", min_value=1, max_value=400, value=60,
+                                        help="依 API 配額調整，避免請求過於頻繁")
+    
     # 檔案上傳
     uploaded_file = st.file_uploader("上傳包含網址的 Excel 檔案", type=['xlsx', 'xls'])
     
@@ -103,8 +86,8 @@ def main():
     if uploaded_file:
         try:
             # 讀取所有工作表名稱
-            excel_file = pd.ExcelFile(uploaded_file)
-            st.session_state.sheet_names = excel_file.sheet_names
+            workbook_cache = get_workbook_cache()
+            st.session_state.sheet_names = workbook_cache.sheet_names(uploaded_file)
             
             # 讓用戶選擇工作表
             selected_sheet = st.selectbox(
@@ -113,7 +96,7 @@ def main():
             )
             
             # 預覽選擇的工作表內容
-            preview_df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+            preview_df = workbook_cache.preview(uploaded_file, selected_sheet)
             st.write("工作表預覽：")
             st.dataframe(preview_df.head())
             
@@ -127,7 +110,7 @@ def main():
     if analyze_button and uploaded_file and api_key:
         try:
             # 讀取選擇的工作表
-            df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+            df = get_workbook_cache().read_sheet(uploaded_file, selected_sheet)
             
             # 確保數據是單一欄位的 URL 列表
             if len(df.columns) > 1:
@@ -143,54 +126,56 @@ def main():
             status_text = st.empty()
             results_placeholder = st.empty()
             
-            results = []
-            for i, url in enumerate(urls):
-                status_text.text(f"正在分析 {url}")
-                result = get_pagespeed_insights(url, api_key)
-                if result:
+            results = ResultBuffer()
+            # 以令牌桶限速，避免 API 請求過於頻繁
+            rate_limiter = TokenBucket(rate_per_minute, per=60, capacity=max_workers)
+            batch = run_batch(urls, with_retries(lambda url: get_pagespeed_insights(url, api_key)),
+                              max_workers=max_workers, rate_limiter=rate_limiter)
+            # 結果表格最多每 2 秒重繪一次
+            refresh = RefreshThrottle(interval=2.0)
+            started_at = time.monotonic()
+            # 依完成順序處理結果
+            for i, (url, result, error) in enumerate(batch, start=1):
+                status_text.text(f"已完成 {i}/{len(urls)}：{url}　{format_eta(started_at, i, len(urls))}")
+                if error:
+                    st.error(f"分析 {url} 時發生錯誤: {str(error)}")
+                else:
                     results.append(result)
                     
                 # 更新進度
-                progress = (i + 1) / len(urls)
+                progress = i / len(urls)
                 progress_bar.progress(progress)
                 
                 # 即時顯示結果
-                if results:
-                    results_df = pd.DataFrame(results)
-                    results_placeholder.dataframe(results_df)
-                
-                # 避免 API 請求過於頻繁
-                time.sleep(1)
+                if len(results) and refresh.due(len(results)):
+                    results_placeholder.dataframe(results.to_frame())
             
+            results_placeholder.empty()
             status_text.text("分析完成！")
             
-            # 儲存結果到 session state
-            st.session_state.results = results
+            # 儲存結果到共用儲存（緊湊的欄式型別），並附加到歷史分數
+            results_df = get_session_store().put(session_key(), 'results', results.to_frame())
+            ScoreHistory().append(results_df)
             st.session_state.analysis_complete = True
             
         except Exception as e:
             st.error(f"處理檔案時發生錯誤: {str(e)}")
     
     # 如果分析完成，顯示結果和下載按鈕
-    if st.session_state.analysis_complete and st.session_state.results:
-        results_df = pd.DataFrame(st.session_state.results)
-        
+    results_df = get_session_store().get(session_key(), 'results') if st.session_state.analysis_complete else None
+    if st.session_state.analysis_complete and results_df is None:
+        st.info("查詢結果已因閒置過久而清除，請重新查詢")
+    if results_df is not None and len(results_df):
         # 顯示結果表格
         st.dataframe(results_df)
         
         # 下載按鈕
-        csv = results_df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="下載 CSV 檔案",
-            data=csv,
-            file_name=f"pagespeed_results_{selected_sheet}.csv",
-            mime="text/csv"
-        )
+        download_results(results_df, f"pagespeed_results_{selected_sheet}", key="results")
 
     # 重置按鈕
     if st.session_state.analysis_complete:
         if st.button("重新開始"):
-            st.session_state.results = None
+            get_session_store().discard(session_key(), 'results')
             st.session_state.analysis_complete = False
             st.session_state.sheet_names = None
             st.experimental_rerun()
@@ -5,32 +5,10 @@
 
 
 import streamlit as st
-import pandas as pd
-import requests
-import time
-
-def get_pagespeed_insights(url, api_key):
-    """獲取 PageSpeed Insights 數據"""
-    api_url = 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed'
-    params = {
-        'url': url,
-        'key': api_key,
-        'strategy': 'mobile',
-        'category': ['accessibility', 'best-practices', 'performance', 'seo']
-    }
-    try:
-        response = requests.get(api_url, params=params)
-        result = response.json()
-        return {
-            'url': url,
-            'performance': result['lighthouseResult']['categories']['performance']['score'] * 100,
-            'accessibility': result['lighthouseResult']['categories']['accessibility']['score'] * 100,
-            'best_practices': result['lighthouseResult']['categories']['best-practices']['score'] * 100,
-            'seo': result['lighthouseResult']['categories']['seo']['score'] * 100
-        }
-    except Exception as e:
-        st.error(f"分析 {url} 時發生錯誤: {str(e)}")
-        return None
+from app_common import get_workbook_cache
+from pagespeed_api import get_pagespeed_insights
+from pagespeed_batch import TokenBucket, run_batch, with_retries
+from results_buffer import ResultBuffer, RefreshThrottle
 
 def main():
     st.set_page_config(page_title="PageSpeed Insights 自動查詢工具", layout="wide")
@@ -47,15 +25,22 @@ def main():
         help="如果沒有 API Key，請前往 https://developers.google.com/speed/docs/insights/v5/get-started?hl=zh-tw 取得"
     )
 
+    # 並行與限速設定
+    col1, col2 = st.columns(2)
+    max_workers = col1.number_input("同時查詢數量", min_value=1, max_value=16, value=4,
+                                    help="同時進行中的 API 請求數量")
+    rate_per_minute = col2.number_input("每分鐘請求上限", min_value=1, max_value=400, value=60,
+                                        help="依 API 配額調整，避免請求過於頻繁")
+
     # 檔案上傳
     uploaded_file = st.file_uploader("上傳包含網址的 Excel 檔案", type=['xlsx', 'xls'])
     if uploaded_file:
         try:
             # 讀取 Excel 檔案
-            excel_file = pd.ExcelFile(uploaded_file)
-            sheet_names = excel_file.sheet_names
+            workbook_cache = get_workbook_cache()
+            sheet_names = workbook_cache.sheet_names(uploaded_file)
             selected_sheet = st.selectbox("請選擇要分析的工作表", sheet_names)
-            preview_df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+            preview_df = workbook_cache.preview(uploaded_file, selected_sheet)
             st.write("工作表預覽：")
             st.dataframe(preview_df.head())
         except Exception as e:
@@ -67,22 +52,30 @@ def main():
     if analyze_button and api_key and uploaded_file:
         try:
             # 分析選擇的工作表
-            df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+            df = get_workbook_cache().read_sheet(uploaded_file, selected_sheet)
             urls = df[df.columns[0]].dropna().tolist()
             st.write(f"共發現 {len(urls)} 個網址")
             progress_bar = st.progress(0)
-            results = []
+            results_placeholder = st.empty()
+            results = ResultBuffer()
 
-            for i, url in enumerate(urls):
-                result = get_pagespeed_insights(url, api_key)
-                if result:
+            rate_limiter = TokenBucket(rate_per_minute, per=60, capacity=max_workers)
+            batch = run_batch(urls, with_retries(lambda url: get_pagespeed_insights(url, api_key)),
+                              max_workers=max_workers, rate_limiter=rate_limiter)
+            # 結果表格最多每 2 秒重繪一次
+            refresh = RefreshThrottle(interval=2.0)
+            for i, (url, result, error) in enumerate(batch):
+                if error:
+                    st.error(f"分析 {url} 時發生錯誤: {str(error)}")
+                else:
                     results.append(result)
+                    if refresh.due(len(results)):
+                        results_placeholder.dataframe(results.to_frame())
                 progress_bar.progress((i + 1) / len(urls))
-                time.sleep(1)
 
             # 顯示結果
-            results_df = pd.DataFrame(results)
-            st.dataframe(results_df)
+            results_df = results.to_frame()
+            results_placeholder.dataframe(results_df)
         except Exception as e:
             st.error(f"分析過程中出現錯誤: {e}")
 
@@ -4,79 +4,200 @@
 # In[ ]:
 
 
+import os
+import time
+import threading
 import streamlit as st
 import pandas as pd
-import requests
-import time
 from io import BytesIO
+from pagespeed_api import DEFAULT_STRATEGY, DEFAULT_CATEGORIES
+from pagespeed_batch import (AdaptiveConcurrency, LatencyTracker, deadline_after,
+                             with_hedging, with_retries)
+from pagespeed_cache import ResultCache
+from pagespeed_pool import SharedResultPool
+from results_buffer import format_eta
+from pagespeed_jobs import JobManager, CANCELLED, FAILED
+from pagespeed_checkpoint import RunCheckpoint, list_runs
+from pagespeed_keys import DEFAULT_DAILY_QUOTA, ApiKeyPool, parse_api_keys
+from report_archive import ReportArchive
+from score_history import ScoreHistory, VALUE_COLUMNS
+from perf_metrics import METRICS, profiled, start_metrics_server
+from sitemap_source import SitemapReader
+from tag_counter import count_tags, count_tags_in_file, tags_to_frame
+from url_sampling import DEFAULT_MIN_SIBLINGS, plan_sample
+from change_detector import ChangeDetector, PageStateStore
+from audit_matrix import STRATEGIES, AuditTask, audit, build_variants, expand_tasks, pivot_wide, tag_result
+from app_common import download_results, get_session_store, get_workbook_cache, session_key
 
 def process_tags(df, tag_column):
     """處理標籤統計"""
-    tag_counts = {}
-    
-    for tags in df[tag_column]:
-        if pd.notna(tags):
-            tags_list = str(tags).split(',')
-            for tag in tags_list:
-                tag = tag.strip()
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
-    
-    tags_stat = pd.DataFrame.from_dict(tag_counts, orient='index', columns=['次數'])
-    tags_stat.index.name = '標籤'
-    
-    return tags_stat
-
-def get_pagespeed_insights(url, api_key):
-    """獲取 PageSpeed Insights 數據"""
-    api_url = 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed'
-    params = {
-        'url': url,
-        'key': api_key,
-        'strategy': 'mobile',
-        'category': ['accessibility', 'best-practices', 'performance', 'seo']
-    }
-    
+    return tags_to_frame(count_tags(df[tag_column]))
+
+@st.cache_resource
+def get_result_cache():
+    """取得整個程序共用的結果快取"""
+    return ResultCache()
+
+@st.cache_resource
+def get_shared_pool():
+    """取得跨 session 共用的查詢池，讓同時查詢相同網址的使用者共用一次請求"""
+    return SharedResultPool()
+
+@st.cache_resource
+def get_report_archive():
+    """取得共用的完整報告封存"""
+    return ReportArchive()
+
+@st.cache_resource
+def get_score_history():
+    """取得共用的歷史分數儲存"""
+    return ScoreHistory()
+
+@st.cache_resource
+def get_page_state_store():
+    """取得共用的頁面狀態記錄，供增量查詢判斷頁面是否變更"""
+    return PageStateStore()
+
+@st.cache_resource
+def get_api_key_pool(keys):
+    """取得整個程序共用的 API Key 池（依 Key 組合），用量、限速與暫停狀態跨任務與 session 保留"""
+    return ApiKeyPool(list(keys))
+
+@st.cache_resource
+def get_job_manager():
+    """取得整個程序共用的背景任務管理器；已結束任務的結果表與 session 結果表共用同一個儲存與記憶體預算"""
+    return JobManager(store=get_session_store())
+
+@st.cache_resource
+def get_metrics_server():
+    """設定 PAGESPEED_METRICS_PORT 時，在背景提供 /metrics 與 /metrics.json"""
+    port = os.environ.get('PAGESPEED_METRICS_PORT')
+    return start_metrics_server(int(port)) if port else None
+
+def get_secret_api_keys():
+    """從 secrets 的 pagespeed_api_keys 讀取 API Key，未設定時回傳 None"""
     try:
-        response = requests.get(api_url, params=params)
-        result = response.json()
-        
-        return {
-            'url': url,
-            'performance': result['lighthouseResult']['categories']['performance']['score'] * 100,
-            'accessibility': result['lighthouseResult']['categories']['accessibility']['score'] * 100,
-            'best_practices': result['lighthouseResult']['categories']['best-practices']['score'] * 100,
-            'seo': result['lighthouseResult']['categories']['seo']['score'] * 100
-        }
-    except Exception as e:
-        st.error(f"分析 {url} 時發生錯誤: {str(e)}")
+        return st.secrets.get('pagespeed_api_keys')
+    except FileNotFoundError:
         return None
 
+def pagespeed_settings():
+    """顯示並行、限速、快取與逾時重試設定，回傳設定值"""
+    settings = {}
+    
+    # 並行與限速設定
+    col1, col2, col3 = st.columns(3)
+    settings['max_workers'] = col1.number_input("同時查詢數量", min_value=1, max_value=16, value=4,
+                                                help="同時進行中的 API 請求數量")
+    settings['rate_per_minute'] = col2.number_input("每組 API Key 每分鐘請求上限", min_value=1, max_value=400,
+                                                    value=60, help="依 API 配額調整，避免請求過於頻繁")
+    settings['daily_quota'] = col3.number_input("每組 API Key 每日配額", min_value=1, value=DEFAULT_DAILY_QUOTA,
+                                                help="與 Google Cloud Console 中的每日配額一致，用完的 Key 會暫停到配額重置")
+    
+    col1, col2 = st.columns(2)
+    settings['adaptive'] = col1.checkbox("自動調整並行數量",
+                                         help="延遲與錯誤率正常時逐步增加並行數量，遇到 429 或逾時則大幅降低")
+    settings['max_concurrency'] = col2.number_input("自動調整的並行上限", min_value=1, max_value=64, value=32,
+                                                    disabled=not settings['adaptive'])
+    
+    # 快取設定
+    col1, col2 = st.columns(2)
+    settings['cache_ttl_hours'] = col1.number_input("快取有效時間（小時）", min_value=0, max_value=24 * 30, value=24,
+                                                    help="在有效時間內查詢過的網址會直接使用快取結果")
+    settings['force_refresh'] = col2.checkbox("強制重新查詢", help="忽略快取，重新查詢所有網址")
+    
+    # 增量查詢設定
+    col1, col2 = st.columns(2)
+    settings['incremental'] = col1.checkbox("只查詢有變更的頁面",
+                                            help="先以 ETag / Last-Modified 或頁面內容雜湊檢查，沒有變更的頁面沿用上次的分數")
+    settings['max_age_days'] = col2.number_input("最久沿用天數", min_value=1, max_value=365, value=30,
+                                                 disabled=not settings['incremental'],
+                                                 help="即使頁面沒有變更，上次查詢超過這個天數也會重新查詢")
+    
+    # 逾時與重試設定
+    with st.expander("逾時與重試設定"):
+        col1, col2 = st.columns(2)
+        settings['timeout'] = col1.number_input("單次請求逾時（秒）", min_value=5, max_value=300, value=60)
+        settings['max_retries'] = col2.number_input("失敗重試次數", min_value=0, max_value=10, value=3,
+                                                    help="逾時、連線錯誤與 429/5xx 會以指數退避重試，並遵守 Retry-After")
+        col1, col2 = st.columns(2)
+        settings['deadline_minutes'] = col1.number_input("整體時限（分鐘，0 表示不限）", min_value=0, value=0,
+                                                         help="超過時限後不再送出新的請求，未查詢的網址可稍後續跑")
+        settings['hedge'] = col2.checkbox("對慢速請求送出備援請求",
+                                          help="請求耗時超過近期 p95 時再送出一次，採用先完成的結果")
+    # 查詢矩陣：所有組合共用同一個查詢佇列
+    with st.expander("查詢矩陣（策略、語系、類別）"):
+        strategies = st.multiselect("策略", STRATEGIES, default=[DEFAULT_STRATEGY],
+                                    help="同時選擇 mobile 與 desktop 時，兩者在同一批次中並行查詢")
+        locales = st.text_input("語系（以逗號分隔，例如 zh-TW, en；留空使用預設）")
+        categories = st.multiselect("類別", DEFAULT_CATEGORIES, default=DEFAULT_CATEGORIES)
+        settings['variants'] = build_variants(strategies, [locale.strip() for locale in locales.split(',')
+                                                           if locale.strip()], [categories] if categories else None)
+        if len(settings['variants']) > 1:
+            st.caption(f"每個網址查詢 {len(settings['variants'])} 種組合，結果以每個網址一列的寬表呈現")
+    settings['archive'] = st.checkbox("封存完整報告",
+                                      help="以壓縮格式保存完整的 Lighthouse 回應，之後可離線擷取新的指標，不需重新查詢")
+    return settings
+
+def sampling_settings():
+    """網址去重與樣板抽樣設定"""
+    settings = {}
+    with st.expander("網址去重與抽樣"):
+        settings['dedupe'] = st.checkbox("去除重複網址", value=True,
+                                         help="忽略追蹤參數（utm_ 等）、結尾斜線與參數順序後相同的網址只查詢一次")
+        col1, col2 = st.columns(2)
+        settings['per_group'] = col1.number_input("每個網址樣板最多查詢（0 表示全部）", min_value=0, value=0,
+                                                  disabled=not settings['dedupe'],
+                                                  help="路徑結構相同的網址（例如商品頁）只抽樣查詢幾個，並以樣本估計整組分數")
+        settings['min_siblings'] = col2.number_input("同層幾個以上的頁面視為同一樣板", min_value=2,
+                                                     value=DEFAULT_MIN_SIBLINGS,
+                                                     disabled=not settings['dedupe'] or not settings['per_group'])
+    return settings
+
 def pagespeed_tool():
     """PageSpeed Insights 工具介面"""
     st.header("PageSpeed Insights 自動查詢工具")
     st.write('此工具可以幫助你自動查詢多個網址的 PageSpeed Insights 效能指標。')
     
-    # 初始化 session state
-    if 'results' not in st.session_state:
-        st.session_state.results = None
+    # 初始化 session state（結果表由背景任務保存，session state 只記錄任務 ID）
     if 'analysis_complete' not in st.session_state:
         st.session_state.analysis_complete = False
     if 'sheet_names' not in st.session_state:
         st.session_state.sheet_names = None
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = st.query_params.get('job')
     
     # API Key 輸入
     api_key = st.text_input("請輸入 Google PageSpeed Insights API Key", 
                            type="password",
                            help="如果沒有 API Key，請前往 https://developers.google.com/speed/docs/insights/v5/get-started?hl=zh-tw 取得")
+    with st.expander("使用多組 API Key"):
+        extra_keys = st.text_area("其他 API Key（每行一組）",
+                                  help="請求會分散到所有 Key，各自計算配額；也可在 secrets 設定 pagespeed_api_keys")
+    api_keys = parse_api_keys(api_key, extra_keys, get_secret_api_keys())
+    if len(api_keys) > 1:
+        st.caption(f"共 {len(api_keys)} 組 API Key")
+    
+    settings = pagespeed_settings()
     
-    # 檔案上傳
-    uploaded_file = st.file_uploader("上傳包含網址的 Excel 檔案", type=['xlsx', 'xls'], key="pagespeed_uploader")
+    # 網址來源：Excel 檔案或 sitemap
+    url_source = st.radio("網址來源", ["Excel 檔案", "Sitemap"], horizontal=True, key="url_source")
+    uploaded_file = None
+    if url_source == "Excel 檔案":
+        uploaded_file = st.file_uploader("上傳包含網址的 Excel 檔案", type=['xlsx', 'xls'], key="pagespeed_uploader")
+        sampling = sampling_settings()
+    else:
+        sitemap_files = st.file_uploader("上傳 sitemap 或 sitemap index（.xml / .gz）", type=['xml', 'gz'],
+                                         accept_multiple_files=True, key="sitemap_uploader",
+                                         help="sitemap index 引用的子 sitemap 可一併上傳，否則會依網址下載")
+        sitemap_location = st.text_input("或輸入 sitemap 的網址或伺服器上的路徑").strip()
+        sitemap_limit = st.number_input("最多查詢網址數（0 表示不限）", min_value=0, value=0)
     
     if uploaded_file:
         try:
             # 讀取所有工作表名稱
-            excel_file = pd.ExcelFile(uploaded_file)
-            st.session_state.sheet_names = excel_file.sheet_names
+            workbook_cache = get_workbook_cache()
+            st.session_state.sheet_names = workbook_cache.sheet_names(uploaded_file)
             
             # 讓用戶選擇工作表
             selected_sheet = st.selectbox(
@@ -85,7 +206,7 @@ def pagespeed_tool():
             )
             
             # 預覽選擇的工作表內容
-            preview_df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+            preview_df = workbook_cache.preview(uploaded_file, selected_sheet)
             st.write("工作表預覽：")
             st.dataframe(preview_df.head())
             
@@ -96,9 +217,15 @@ def pagespeed_tool():
     # 分析按鈕
     analyze_button = st.button("開始查詢")
     
-    if analyze_button and uploaded_file and api_key:
+    if analyze_button and url_source == "Sitemap" and api_keys and (sitemap_files or sitemap_location):
+        try:
+            start_sitemap_job(sitemap_files, sitemap_location, sitemap_limit, api_keys, settings)
+        except Exception as e:
+            st.error(f"讀取 sitemap 時發生錯誤: {str(e)}")
+    
+    if analyze_button and uploaded_file and api_keys:
         try:
-            df = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
+            df = get_workbook_cache().read_sheet(uploaded_file, selected_sheet)
             
             if len(df.columns) > 1:
                 st.warning("請確保工作表只包含一個欄位的 URL 列表")
@@ -108,31 +235,285 @@ def pagespeed_tool():
             
             st.write(f"共發現 {len(urls)} 個網址")
             
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            results_placeholder = st.empty()
+            # 去除重複與追蹤參數，並可依網址樣板抽樣查詢
+            plan = None
+            if sampling['dedupe']:
+                plan = plan_sample(urls, per_group=sampling['per_group'], min_siblings=sampling['min_siblings'])
+                urls = plan.sampled_urls
+                st.write(plan.describe())
+            
+            # 每個網址展開成查詢矩陣的所有組合
+            tasks = expand_tasks(urls, settings['variants'])
             
-            results = []
-            for i, url in enumerate(urls):
-                status_text.text(f"正在查詢 {url}")
-                result = get_pagespeed_insights(url, api_key)
+            # 先從快取取出仍有效的結果，只查詢新的或過期的組合
+            cached = []
+            pending_tasks = []
+            for task in tasks:
+                result = cached_result(task, settings)
                 if result:
-                    results.append(result)
-                    
-                progress = (i + 1) / len(urls)
-                progress_bar.progress(progress)
-                
-                if results:
-                    results_df = pd.DataFrame(results)
-                    results_placeholder.dataframe(results_df)
-                
-                time.sleep(1)
+                    cached.append((task, result))
+                else:
+                    pending_tasks.append(task)
+            if cached:
+                st.write(f"{len(cached)} 個查詢使用快取結果")
+            
+            # 建立檢查點，之後每完成一個查詢就寫入磁碟
+            checkpoint = RunCheckpoint.create([task.key for task in tasks], variants=settings['variants'])
+            checkpoint.record_many((task.key, result) for task, result in cached)
             
-            status_text.text("查詢完成！")
-            st.session_state.results = results
-            st.session_state.analysis_complete = True           
+            start_job(checkpoint, pending_tasks, [result for _, result in cached], api_keys, settings,
+                      monitors={'sampling': plan} if plan is not None and plan.per_group else None)
         except Exception as e:
             st.error(f"處理檔案時發生錯誤: {str(e)}")
+    
+    # 重新連結先前的任務（例如從其他分頁或重新開啟的瀏覽器），或從檢查點續跑中斷的任務
+    with st.expander("重新連結或續跑查詢任務"):
+        job_id_input = st.text_input("任務 ID", value=st.session_state.job_id or "").strip()
+        unfinished_runs = [run for run in list_runs() if run['done'] < run['total'] or not run['complete']]
+        if unfinished_runs:
+            st.caption("未完成的任務：" + "、".join(
+                f"{run['run_id']}（{run['done']}/{run['total']}）" for run in unfinished_runs[:5]))
+        
+        col1, col2 = st.columns(2)
+        if col1.button("連結") and job_id_input:
+            if get_job_manager().get(job_id_input):
+                st.session_state.job_id = job_id_input
+                st.session_state.analysis_complete = False
+                st.query_params['job'] = job_id_input
+            else:
+                st.error("找不到此任務，可能已過期或伺服器已重新啟動，請改用「續跑」")
+        if col2.button("續跑", help="略過檢查點中已完成的網址，只查詢剩下的部分") and job_id_input:
+            job = get_job_manager().get(job_id_input)
+            if not job_id_input.isalnum() or not RunCheckpoint(job_id_input).exists():
+                st.error("找不到此任務的檢查點")
+            elif job is not None and not job.finished:
+                st.warning("此任務仍在執行中")
+            elif not api_keys:
+                st.warning("請先輸入 API Key")
+            elif not RunCheckpoint(job_id_input).load()[0]['complete']:
+                # 串流來源（sitemap）未讀完，重新讀取來源並略過已完成的組合
+                st.write("網址來源尚未讀完，重新讀取 sitemap 並略過已完成的查詢")
+                stream_sitemap(RunCheckpoint(job_id_input), api_keys, settings)
+            else:
+                checkpoint = RunCheckpoint(job_id_input)
+                completed_results, pending_keys = checkpoint.remaining()
+                st.write(f"已完成 {len(completed_results)} 個查詢，剩餘 {len(pending_keys)} 個")
+                start_job(checkpoint, [AuditTask.from_key(key) for key in pending_keys], completed_results,
+                          api_keys, settings)
+    
+    if st.session_state.job_id:
+        job = get_job_manager().get(st.session_state.job_id)
+        if job is not None and not job.finished:
+            show_running_job(job.id)
+        else:
+            show_job(st.session_state.job_id)
+
+def start_sitemap_job(sitemap_files, sitemap_location, limit, api_keys, settings):
+    """邊解析 sitemap 邊查詢：找到的網址直接送進查詢佇列，不必等整份 sitemap 讀完"""
+    checkpoint = RunCheckpoint.create([], source='sitemap', streaming=True, variants=settings['variants'],
+                                      sitemap_location=sitemap_location or None, limit=limit or None,
+                                      uploaded=[file.name for file in sitemap_files or []])
+    # 上傳的檔案保存到檢查點旁，中斷後續跑時重新讀取整份 sitemap
+    for index, file in enumerate(sitemap_files or []):
+        checkpoint.save_source(index, file.getvalue())
+    return stream_sitemap(checkpoint, api_keys, settings)
+
+def stream_sitemap(checkpoint, api_keys, settings):
+    """依檢查點記錄的 sitemap 來源與查詢組合開始（或續跑）串流任務，已完成的組合直接沿用"""
+    header, completed = checkpoint.load()
+    # 每次都從保存的檔案建立新的副本，背景執行緒讀取時不受之後的 rerun 影響
+    uploaded = {}
+    for index, name in enumerate(header.get('uploaded', [])):
+        with open(checkpoint.source_path(index), 'rb') as f:
+            copy = BytesIO(f.read())
+        copy.name = name
+        uploaded[name] = copy
+    sources = ([header['sitemap_location']] if header.get('sitemap_location') else []) + list(uploaded.values())
+    reader = SitemapReader(uploaded_files=uploaded, limit=header.get('limit'))
+    variants = [(strategy, locale, tuple(categories)) for strategy, locale, categories in header['variants']]
+    
+    def lookup(task):
+        # 仍有效的快取結果直接沿用
+        result = cached_result(task, settings)
+        if result:
+            checkpoint.record_later(task.key, result)
+        return result
+    
+    # 續跑時重新讀取整份 sitemap（重新記錄全部網址，讀取時去除重複），略過檢查點中已完成的組合
+    tasks = checkpoint.track(expand_tasks(reader.iter_sources(sources), variants), key=lambda task: task.key)
+    tasks = (task for task in tasks if task.key not in completed)
+    return start_job(checkpoint, tasks, list(completed.values()), api_keys, settings, lookup=lookup,
+                     monitors={'sitemap': reader})
+
+def cached_result(task, settings):
+    """取得查詢組合仍有效的快取結果，沒有或強制重新查詢時回傳 None"""
+    if settings['force_refresh']:
+        return None
+    cached = get_result_cache().get(task.url, task.strategy, task.categories, locale=task.locale,
+                                    ttl=settings['cache_ttl_hours'] * 3600)
+    return tag_result(task, cached) if cached else None
+
+def start_job(checkpoint, pending_tasks, completed_results, api_keys, settings, lookup=None, monitors=None):
+    """以檢查點的 run ID 作為任務 ID，在背景查詢尚未完成的組合（AuditTask）
+
+    pending_tasks 可以是產生器（例如 sitemap），會邊讀取邊查詢；lookup(task) 回傳結果時直接沿用。
+    """
+    cache = get_result_cache()
+    pool = get_shared_pool()
+    deadline = deadline_after(settings['deadline_minutes'] * 60)
+    monitors = dict(monitors or {})
+    
+    # 每組 API Key 各自套用每分鐘請求上限，配額錯誤的 Key 會自動暫停
+    # 同一組 Key 共用同一個池，配額用量不因新任務或其他 session 而重新計算
+    key_pool = get_api_key_pool(tuple(sorted(api_keys)))
+    key_pool.configure(rate_per_minute=settings['rate_per_minute'], daily_quota=settings['daily_quota'])
+    monitors['keys'] = key_pool
+    archive = get_report_archive() if settings['archive'] else None
+    # 停止任務或超過時限時，等待 API Key 的請求也會中斷
+    cancel = threading.Event()
+    request = key_pool.wrap(lambda task, api_key: audit(task, api_key, timeout=settings['timeout'], archive=archive),
+                            deadline=deadline, stop=cancel.is_set)
+    
+    # 以 AIMD 控制器決定同時進行的請求數，執行緒池開到控制器的上限
+    max_workers = settings['max_workers']
+    if settings['adaptive']:
+        max_workers = max(settings['max_concurrency'], settings['max_workers'])
+        controller = AdaptiveConcurrency(initial=settings['max_workers'], max_limit=max_workers)
+        monitors['concurrency'] = controller
+        request = controller.wrap(request)
+    hedged = None
+    if settings['hedge']:
+        request = hedged = with_hedging(request, LatencyTracker(), max_workers=max_workers)
+    request = with_retries(request, max_retries=settings['max_retries'], deadline=deadline)
+    
+    def fetch(task):
+        # 只有實際送出請求時才消耗令牌，與其他 session 合併的請求不重複計算
+        return pool.fetch(task.cache_key, lambda: request(task), refresh=settings['force_refresh'])
+    
+    # 增量查詢：先檢查頁面是否變更，沒有變更的組合沿用上次的分數
+    detector = None
+    if settings['incremental'] and not settings['force_refresh']:
+        detector = ChangeDetector(get_page_state_store(), max_age=settings['max_age_days'] * 24 * 60 * 60)
+        monitors['changes'] = detector
+        pending_tasks = detector.check_all(pending_tasks)
+        fallback = lookup
+        
+        def lookup(task):
+            result = detector.carried(task)
+            if result is None:
+                return fallback(task) if fallback is not None else None
+            checkpoint.record_later(task.key, result)
+            return result
+    
+    def save_result(task, result):
+        cache.set(task.url, task.strategy, task.categories, result, locale=task.locale)
+        checkpoint.record(task.key, result)
+        if detector is not None:
+            detector.save(task, result)
+    
+    def save_history(job):
+        # 每次任務結束時，將本次實際查詢到的結果附加到歷史分數
+        history = get_score_history()
+        history.append(job.fetched_frame(), run_id=job.id, strategy=DEFAULT_STRATEGY,
+                       run_at=pd.Timestamp(job.created_at, unit='s', tz='UTC'))
+    
+    def finish(job):
+        try:
+            # 沿用的結果分批寫入檢查點，結束時寫出剩下的部分
+            checkpoint.flush()
+            save_history(job)
+        finally:
+            # 每個任務各自建立備援請求的執行緒池，任務結束時釋放
+            if hedged is not None:
+                hedged.close()
+    
+    # 在背景執行緒執行批次，切換工具或關閉分頁都不會中斷
+    job = get_job_manager().submit(pending_tasks, fetch, max_workers=max_workers, deadline=deadline,
+                                   on_result=save_result, initial_results=completed_results,
+                                   job_id=checkpoint.run_id, monitors=monitors, on_finish=finish,
+                                   lookup=lookup, cancel=cancel)
+    st.session_state.job_id = job.id
+    st.session_state.analysis_complete = False
+    st.query_params['job'] = job.id
+    return job
+
+@METRICS.timed('job_view_render_seconds')
+def show_job(job_id):
+    """顯示背景任務的進度與結果"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        st.warning(f"找不到任務 {job_id}")
+        return
+    
+    st.caption(f"任務 ID：{job.id}（可用於重新連結）")
+    st.progress(job.done / job.total if job.total else float(job.total_known))
+    
+    detector = job.monitors.get('changes')
+    if detector is not None:
+        st.caption(detector.describe())
+    
+    reader = job.monitors.get('sitemap')
+    if reader is not None:
+        st.caption(f"Sitemap：已讀取 {reader.sitemaps} 個檔案，找到 {len(reader.seen)} 個網址，"
+                   f"略過重複 {reader.duplicates} 個")
+        if reader.errors:
+            with st.expander(f"{len(reader.errors)} 個子 sitemap 無法讀取"):
+                for location, message in reader.errors:
+                    st.error(f"{location}: {message}")
+    
+    if not job.finished:
+        if job.total_known:
+            status = f"已完成 {job.done}/{job.total}　{format_eta(job.started_at, job.fetched, job.total - job.skipped)}"
+        else:
+            status = f"已完成 {job.done}/{job.total}（仍在讀取網址）"
+        col1, col2 = st.columns([4, 1])
+        col1.text(status)
+        if col2.button("停止查詢", key=f"cancel_{job.id}"):
+            job.cancel()
+        controller = job.monitors.get('concurrency')
+        if controller is not None:
+            st.caption(f"目前並行上限：{controller.limit}（進行中 {controller.in_flight}）　"
+                       f"近一分鐘吞吐量：{controller.throughput():.1f} 個/分鐘")
+        else:
+            st.caption(f"吞吐量：{job.throughput():.1f} 個/分鐘")
+        key_pool = job.monitors.get('keys')
+        if key_pool is not None and len(key_pool) > 1:
+            st.dataframe(pd.DataFrame(key_pool.status()), hide_index=True)
+    elif job.status == FAILED:
+        st.error(f"處理檔案時發生錯誤: {str(job.error)}")
+    elif job.status == CANCELLED:
+        st.text(f"已停止，完成 {job.done}/{job.total}")
+    else:
+        st.text("查詢完成！")
+    
+    errors = job.errors()
+    if errors:
+        with st.expander(f"{len(errors)} 個網址查詢失敗"):
+            for url, message in errors:
+                st.error(f"分析 {url} 時發生錯誤: {message}")
+    
+    # 查詢矩陣有多種組合時，以每個網址一列的寬表呈現
+    results_df = pivot_wide(job.results_frame())
+    if len(results_df):
+        st.dataframe(results_df)
+        if job.finished:
+            download_results(results_df, f"pagespeed_results_{job.id}", key=f"job_{job.id}")
+    
+    plan = job.monitors.get('sampling')
+    if plan is not None and len(results_df):
+        st.write(f"樣板估計（每個樣板抽樣 {plan.per_group} 個，平均分數代表整組）：")
+        estimates_df = plan.estimates(results_df)
+        st.dataframe(estimates_df, hide_index=True)
+        if job.finished:
+            download_results(estimates_df, f"pagespeed_groups_{job.id}", key=f"groups_{job.id}")
+    
+    if job.finished and not st.session_state.analysis_complete:
+        st.session_state.analysis_complete = True
+        # 任務結束後重新執行整個頁面，停止自動更新
+        st.rerun()
+
+# 任務執行中每 2 秒自動更新一次
+show_running_job = st.fragment(run_every=2)(show_job)
 
 def tag_statistics_tool():
     """標籤統計工具介面"""
@@ -142,18 +523,22 @@ def tag_statistics_tool():
     st.write('請上傳一個包含標籤欄位的檔案。')
     
     uploaded_file = st.file_uploader("選擇檔案", type=['xlsx', 'xls', 'csv'], key="tags_uploader")
+    streaming = st.checkbox("大型檔案串流模式", help="分批讀取檔案並累加計數，記憶體用量不隨檔案大小增加")
     
     if uploaded_file is not None:
         try:
             file_extension = uploaded_file.name.split('.')[-1].lower()
+            # 串流模式只讀取前幾列作為預覽
+            nrows = 5 if streaming else None
+            encoding_option = 'utf-8'
             
             if file_extension == 'csv':
                 encoding_option = st.selectbox('選擇CSV檔案編碼：', 
                                              ['utf-8', 'big5', 'gb18030'], 
                                              help='如果檔案含有中文字且顯示亂碼，請嘗試切換不同編碼')
-                df = pd.read_csv(uploaded_file, encoding=encoding_option)
+                df = pd.read_csv(uploaded_file, encoding=encoding_option, nrows=nrows)
             else:
-                df = pd.read_excel(uploaded_file)
+                df = pd.read_excel(uploaded_file, nrows=nrows)
             
             st.write("資料預覽：")
             st.dataframe(df.head())
@@ -162,23 +547,125 @@ def tag_statistics_tool():
             tag_column = st.selectbox('請選擇包含標籤的欄位：', column_names)
             
             if st.button('開始統計'):
-                result_df = process_tags(df, tag_column)
-                st.write("統計結果：")
-                st.dataframe(result_df)
+                if streaming:
+                    uploaded_file.seek(0)
+                    result_df = tags_to_frame(count_tags_in_file(uploaded_file, uploaded_file.name, tag_column,
+                                                                 encoding=encoding_option))
+                else:
+                    result_df = process_tags(df, tag_column)
+                # session state 只記錄對應的檔案與欄位，結果表存在共用儲存
+                get_session_store().put(session_key(), 'tag_results', result_df)
+                st.session_state.tag_results = (uploaded_file.file_id, tag_column)
+            
+            if st.session_state.get('tag_results') == (uploaded_file.file_id, tag_column):
+                result_df = get_session_store().get(session_key(), 'tag_results')
+                if result_df is None:
+                    st.info("統計結果已因閒置過久而清除，請重新統計")
+                else:
+                    st.write("統計結果：")
+                    st.dataframe(result_df)
+                    # 標籤存在索引中，匯出時轉成欄位
+                    download_results(result_df.reset_index(), "tag_statistics", key="tags")
         except Exception as e:
             st.error(f'處理檔案時發生錯誤：{str(e)}')
 
+def history_tool():
+    """歷史分數趨勢與退步網址查詢"""
+    st.header("歷史分數趨勢")
+    history = get_score_history()
+    
+    col1, col2, col3 = st.columns(3)
+    metric = col1.selectbox("指標", VALUE_COLUMNS)
+    days = col2.number_input("與幾天前比較", min_value=1, max_value=365, value=7)
+    threshold = col3.number_input("下降超過", min_value=0.0, value=10.0,
+                                  help="分數類指標以 0~100 計；毫秒類指標數值越大越差，請改看趨勢")
+    
+    try:
+        regressed = history.regressions(metric, threshold=threshold, days=days)
+    except Exception as e:
+        st.error(f"讀取歷史分數時發生錯誤: {str(e)}")
+        return
+    
+    st.write(f"與 {days} 天前相比，{metric} 下降超過 {threshold:g} 的網址：{len(regressed)} 個")
+    st.dataframe(regressed, hide_index=True)
+    
+    url = st.text_input("查看單一網址的趨勢")
+    if url:
+        trend_df = history.trend(url.strip())
+        if len(trend_df):
+            # 每個策略各畫一條線，mobile 與 desktop 的數值不混在同一條線上
+            st.line_chart(trend_df.pivot_table(index='run_at', columns='strategy', values=metric, observed=True))
+            st.dataframe(trend_df, hide_index=True)
+        else:
+            st.info("沒有此網址的歷史紀錄")
+
+def diagnostics_panel():
+    """側邊欄的效能診斷：各熱點路徑的耗時統計、量測匯出與單次 rerun 剖析"""
+    if not st.sidebar.checkbox("效能診斷", key='show_diagnostics'):
+        return
+    with st.sidebar:
+        summary = pd.DataFrame(METRICS.summary())
+        if len(summary):
+            # 以毫秒顯示
+            for column in ['mean', 'p50', 'p95', 'max']:
+                summary[column] = summary[column].astype(float) * 1000
+            st.dataframe(summary.set_index('metric').round(1), column_config={
+                'count': '次數', 'mean': '平均 ms', 'p50': 'p50 ms', 'p95': 'p95 ms', 'max': '最大 ms'})
+        else:
+            st.caption("尚無量測資料")
+        
+        usage = get_session_store().usage()
+        st.caption(f"結果表儲存：{usage['sessions']} 個 session 或任務、{usage['frames']} 個結果表，"
+                   f"記憶體 {usage['memory_bytes'] / 1024 / 1024:.1f} MB、"
+                   f"磁碟 {usage['spilled_bytes'] / 1024 / 1024:.1f} MB")
+        
+        request_latency = METRICS.snapshot('pagespeed_request_seconds')
+        if request_latency:
+            st.caption("API 請求延遲分布（累積次數）")
+            st.bar_chart(pd.DataFrame(request_latency['buckets'], columns=['秒', '次數']).set_index('秒'))
+        
+        col1, col2 = st.columns(2)
+        col1.download_button("Prometheus", data=METRICS.to_prometheus, file_name="metrics.prom",
+                             mime="text/plain", on_click="ignore")
+        col2.download_button("JSON", data=METRICS.to_json, file_name="metrics.json",
+                             mime="application/json", on_click="ignore")
+        if col1.button("清除量測"):
+            METRICS.reset()
+            st.rerun()
+        if col2.button("剖析一次 rerun", help="以 cProfile 剖析下一次整頁執行"):
+            st.session_state.profile_next_run = True
+            st.rerun()
+        if st.session_state.get('profile_report'):
+            with st.expander("上一次剖析結果"):
+                st.code(st.session_state.profile_report)
+
 def main():   
+    get_metrics_server()
+    get_session_store().touch(session_key())
+    started = time.perf_counter()
+    report = None
+    try:
+        with profiled(st.session_state.pop('profile_next_run', False)) as report:
+            run_selected_tool()
+    finally:
+        METRICS.observe('streamlit_rerun_seconds', time.perf_counter() - started)
+        if report and report['text']:
+            st.session_state.profile_report = report['text']
+    diagnostics_panel()
+
+def run_selected_tool():
     # 工具選單
     tool_option = st.sidebar.selectbox(
         "請選擇工具",
-        ["PageSpeed Insights 自動查詢", "標籤數量統計"],
+        ["PageSpeed Insights 自動查詢", "歷史分數趨勢", "標籤數量統計"],
         key='tool_selector'
     )
     
     # 根據選擇顯示對應工具
     if tool_option == "PageSpeed Insights 自動查詢":
         pagespeed_tool()
+    elif tool_option == "歷史分數趨勢":
+        history_tool()
     else:
         tag_statistics_tool()
 
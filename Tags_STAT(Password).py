@@ -8,6 +8,8 @@ import streamlit as st
 import pandas as pd
 import io
 import hashlib
+from tag_counter import count_tags, count_tags_in_file, tags_to_frame
+from app_common import download_results, get_session_store, session_key
 
 # 設定密碼（這裡使用雜湊值以增加安全性）
 CORRECT_PASSWORD_HASH = "70eded5c719db84ae23a66c1dde35dff5836eabf"  # password123 的 SHA-1 雜湊值
@@ -48,24 +50,8 @@ def check_password():
     return True
 
 def process_tags(df, tag_column):
-    # 創建一個 Dict 來統計標籤的出現次數
-    tag_counts = {}
-    
-    for tags in df[tag_column]:
-        # 檢查是否有遺漏值
-        if pd.notna(tags):
-            # 將標籤以逗號分隔成列表
-            tags_list = str(tags).split(',')
-            for tag in tags_list:
-                # 去除前後的空白並統計標籤的出現次數
-                tag = tag.strip()
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
-    
-    # 將 Dict 轉 Dataframe
-    tags_stat = pd.DataFrame.from_dict(tag_counts, orient='index', columns=['次數'])
-    tags_stat.index.name = '標籤'
-    
-    return tags_stat
+    # 以向量化的字串運算統計整欄標籤，並轉成 Dataframe
+    return tags_to_frame(count_tags(df[tag_column]))
 
 # 主程式開始
 st.title('標籤次數統計器')
@@ -78,19 +64,23 @@ if check_password():
 
     # 檔案上傳器
     uploaded_file = st.file_uploader("選擇檔案", type=['xlsx', 'xls', 'csv'])
+    streaming = st.checkbox("大型檔案串流模式", help="分批讀取檔案並累加計數，記憶體用量不隨檔案大小增加")
 
     if uploaded_file is not None:
         try:
             # 根據檔案類型讀取檔案
             file_extension = uploaded_file.name.split('.')[-1].lower()
+            # 串流模式只讀取前幾列作為預覽
+            nrows = 5 if streaming else None
+            encoding_option = 'utf-8'
             
             if file_extension == 'csv':
                 encoding_option = st.selectbox('選擇CSV檔案編碼：', 
                                              ['utf-8', 'big5', 'gb18030'], 
                                              help='如果檔案含有中文字且顯示亂碼，請嘗試切換不同編碼')
-                df = pd.read_csv(uploaded_file, encoding=encoding_option)
+                df = pd.read_csv(uploaded_file, encoding=encoding_option, nrows=nrows)
             else:
-                df = pd.read_excel(uploaded_file)
+                df = pd.read_excel(uploaded_file, nrows=nrows)
             
             # 顯示檔案內容預覽
             st.write("資料預覽：")
@@ -102,10 +92,26 @@ if check_password():
             
             if st.button('開始統計'):
                 # 處理標籤統計
-                result_df = process_tags(df, tag_column)
+                if streaming:
+                    # 從頭分批讀取整份檔案並累加計數
+                    uploaded_file.seek(0)
+                    result_df = tags_to_frame(count_tags_in_file(uploaded_file, uploaded_file.name, tag_column,
+                                                                 encoding=encoding_option))
+                else:
+                    result_df = process_tags(df, tag_column)
                 
-                # 顯示統計結果
-                st.write("統計結果：")
-                st.dataframe(result_df)
+                get_session_store().put(session_key(), 'tag_results', result_df)
+                st.session_state.tag_results = (uploaded_file.file_id, tag_column)
+            
+            # 顯示統計結果（存在共用儲存，下載時不會消失；session state 只記錄對應的檔案與欄位）
+            if st.session_state.get('tag_results') == (uploaded_file.file_id, tag_column):
+                result_df = get_session_store().get(session_key(), 'tag_results')
+                if result_df is None:
+                    st.info("統計結果已因閒置過久而清除，請重新統計")
+                else:
+                    st.write("統計結果：")
+                    st.dataframe(result_df)
+                    # 標籤存在索引中，匯出時轉成欄位
+                    download_results(result_df.reset_index(), "tag_statistics", key="tags")
         except Exception as e:
             st.error(f'處理檔案時發生錯誤：{str(e)}')
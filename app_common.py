@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""各 Streamlit 介面（Streamlit.py 與兩個密碼保護版本）共用的資源與元件"""
+
+import uuid
+
+import streamlit as st
+
+from results_export import EXPORT_FORMATS, export_bytes, export_file_name
+from session_store import SessionFrameStore
+from workbook_cache import WorkbookCache
+
+
+@st.cache_resource
+def get_workbook_cache():
+    """取得共用的活頁簿解析快取，避免每次 rerun 重新解析同一份檔案"""
+    return WorkbookCache()
+
+
+@st.cache_resource
+def get_session_store():
+    """取得共用的 session 結果表儲存，閒置 session 的結果表會寫到磁碟或刪除"""
+    return SessionFrameStore()
+
+
+def session_key():
+    """目前 session 在共用儲存中的 ID"""
+    if 'session_key' not in st.session_state:
+        st.session_state.session_key = uuid.uuid4().hex
+    return st.session_state.session_key
+
+
+def download_results(frame, base_name, key):
+    """選擇格式並下載結果；檔案在按下下載時才產生，不阻塞頁面執行"""
+    col1, col2 = st.columns([1, 3])
+    fmt = col1.selectbox("匯出格式", list(EXPORT_FORMATS), format_func=lambda code: EXPORT_FORMATS[code][0],
+                         key=f"{key}_format")
+    col2.download_button(
+        label=f"下載 {EXPORT_FORMATS[fmt][0]} 檔案",
+        data=lambda: export_bytes(frame, fmt),
+        file_name=export_file_name(base_name, fmt),
+        mime=EXPORT_FORMATS[fmt][2],
+        on_click="ignore",
+        key=f"{key}_download"
+    )
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""查詢矩陣：每個網址 × 策略（mobile / desktop）× 語系 × 類別組合展開成同一個查詢佇列，
+結果再依網址轉成寬表（例如 performance_mobile、performance_desktop）"""
+
+import itertools
+from collections import namedtuple
+
+import pandas as pd
+
+from pagespeed_api import DEFAULT_CATEGORIES, DEFAULT_STRATEGY, METRIC_FIELDS, SCORE_FIELDS, get_pagespeed_insights
+from pagespeed_cache import make_cache_key
+
+STRATEGIES = ['mobile', 'desktop']
+VARIANT_COLUMNS = ['strategy', 'locale', 'variant']
+
+
+class AuditTask(namedtuple('AuditTask', ['url', 'strategy', 'locale', 'categories'])):
+    """矩陣中的一次查詢；categories 為排序後的 tuple"""
+
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, url, strategy=DEFAULT_STRATEGY, locale=None, categories=DEFAULT_CATEGORIES):
+        return cls(url, strategy, locale or None, tuple(sorted(categories)))
+
+    @property
+    def is_default(self):
+        return (self.strategy == DEFAULT_STRATEGY and self.locale is None
+                and self.categories == tuple(sorted(DEFAULT_CATEGORIES)))
+
+    @property
+    def variant(self):
+        """寬表欄位的後綴，例如 mobile、desktop_en、mobile_performance+seo"""
+        parts = [self.strategy]
+        if self.locale:
+            parts.append(self.locale)
+        if self.categories != tuple(sorted(DEFAULT_CATEGORIES)):
+            parts.append('+'.join(self.categories))
+        return '_'.join(parts)
+
+    @property
+    def key(self):
+        """檢查點與錯誤清單使用的字串；預設組合只用網址，與單一策略的檢查點相容"""
+        if self.is_default:
+            return self.url
+        return '|'.join([self.strategy, self.locale or '', ','.join(self.categories), self.url])
+
+    @classmethod
+    def from_key(cls, key):
+        parts = key.split('|', 3)
+        if len(parts) == 4 and parts[0] in STRATEGIES:
+            strategy, locale, categories, url = parts
+            return cls.create(url, strategy, locale, categories.split(','))
+        return cls.create(key)
+
+    @property
+    def cache_key(self):
+        return make_cache_key(self.url, self.strategy, self.categories, self.locale)
+
+    def __str__(self):
+        return self.url if self.is_default else f"{self.url}（{self.variant}）"
+
+
+def build_variants(strategies=None, locales=None, category_sets=None):
+    """回傳 (strategy, locale, categories) 的所有組合；未指定的維度使用預設值"""
+    return list(itertools.product(strategies or [DEFAULT_STRATEGY], locales or [None],
+                                  [tuple(sorted(categories)) for categories in category_sets or [DEFAULT_CATEGORIES]]))
+
+
+def expand_tasks(urls, variants):
+    """每個網址依序展開成所有組合，同一個網址的各組合會相鄰，寬表的每一列能較早完成
+
+    urls 為 list/tuple 時回傳 list，否則回傳產生器（例如 sitemap 串流）。
+    """
+    tasks = (AuditTask.create(url, strategy, locale, categories)
+             for url in urls for strategy, locale, categories in variants)
+    return list(tasks) if isinstance(urls, (list, tuple)) else tasks
+
+
+def tag_result(task, result):
+    """在結果加上組合欄位，寬表與歷史分數以此區分"""
+    return {**result, 'url': task.url, 'strategy': task.strategy, 'locale': task.locale, 'variant': task.variant}
+
+
+def audit(task, api_key, **kwargs):
+    """查詢一個組合，回傳加上組合欄位的結果"""
+    result = get_pagespeed_insights(task.url, api_key, strategy=task.strategy, categories=list(task.categories),
+                                    locale=task.locale, **kwargs)
+    return tag_result(task, result)
+
+
+def short_labels(variants):
+    """去除所有組合都相同的部分，例如只查詢一種語系時欄位不帶語系後綴"""
+    parts = [variant.split('_') for variant in variants]
+    if len({len(part) for part in parts}) != 1:
+        return {variant: variant for variant in variants}
+    varying = [i for i in range(len(parts[0])) if len({part[i] for part in parts}) > 1]
+    return {variant: '_'.join(part[i] for i in varying) for variant, part in zip(variants, parts)}
+
+
+def pivot_wide(results):
+    """將每個組合一列的結果轉成每個網址一列；只有一種組合時原樣回傳（預設組合不顯示組合欄位）"""
+    frame = pd.DataFrame(results)
+    if 'variant' not in frame:
+        return frame
+    if frame['variant'].nunique() <= 1:
+        if frame['variant'].isin([DEFAULT_STRATEGY]).all() and frame['locale'].isna().all():
+            return frame.drop(columns=VARIANT_COLUMNS)
+        return frame
+    value_columns = [column for column in list(SCORE_FIELDS) + list(METRIC_FIELDS) if column in frame]
+    labels = short_labels(list(dict.fromkeys(frame['variant'])))
+    frame = frame.assign(variant=frame['variant'].map(labels))
+    variants = list(labels.values())
+    wide = frame.groupby(['url', 'variant'], sort=False)[value_columns].first().unstack('variant')
+    columns = [(value, variant) for value in value_columns for variant in variants if (value, variant) in wide]
+    wide = wide[columns]
+    wide.columns = [f"{value}_{variant}" for value, variant in columns]
+    # 類別組合不含某個分數時，整欄都是空值
+    wide = wide.dropna(axis=1, how='all')
+    return wide.reindex(list(dict.fromkeys(frame['url']))).rename_axis('url').reset_index()
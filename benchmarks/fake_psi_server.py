@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""本機的 PageSpeed Insights API 替身，回傳 Lighthouse 結構的假資料，不消耗真實配額
+
+    python benchmarks/fake_psi_server.py --port 8765 --latency lognormal --latency-ms 800 --rate-429 0.05
+
+再以環境變數 PAGESPEED_API_URL=http://127.0.0.1:8765/ 啟動 Streamlit 或 cli.py，即可對假伺服器查詢。
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.lighthouse_fixture import CATEGORY_KEYS, make_lighthouse_response, project_response  # noqa: E402
+
+LATENCY_DISTRIBUTIONS = ['fixed', 'uniform', 'exponential', 'lognormal']
+# 預先產生幾份不同內容的回應輪流使用，避免產生假資料的耗時算進延遲
+DEFAULT_VARIANTS = 8
+
+
+class FakePageSpeedServer:
+    """以執行緒處理請求的假 API 伺服器
+
+    latency_ms 為延遲的中位數（fixed 時為固定值），依 latency 選擇的分布抽樣；
+    rate_429 / rate_500 為回傳錯誤的機率。請求帶 fields 參數時只回傳投影欄位。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency='lognormal', latency_ms=300, latency_sigma=0.5,
+                 rate_429=0.0, rate_500=0.0, retry_after=1, size_kb=1500, variants=DEFAULT_VARIANTS, seed=None):
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支援的延遲分布：{latency}")
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, '429': 0, '500': 0, 'bytes': 0}
+
+        documents = [make_lighthouse_response(f"https://example.com/{i}", size_kb=size_kb, seed=i)
+                     for i in range(variants)]
+        self._full = [json.dumps(document).encode() for document in documents]
+        self._documents = documents
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def sample_latency(self):
+        """依設定的分布抽樣一次延遲（秒）"""
+        median = self.latency_ms / 1000
+        with self._rng_lock:
+            if self.latency == 'fixed':
+                return median
+            if self.latency == 'uniform':
+                return self._rng.uniform(0, 2 * median)
+            if self.latency == 'exponential':
+                # 指數分布的中位數為 ln2 / lambda
+                return self._rng.expovariate(math.log(2) / median) if median > 0 else 0.0
+            return self._rng.lognormvariate(0, self.latency_sigma) * median
+
+    def _roll(self):
+        with self._rng_lock:
+            return self._rng.random(), self._rng.randrange(len(self._full))
+
+    def _count(self, key, size=0):
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats[key] += 1
+            self.stats['bytes'] += size
+
+    def respond(self, query):
+        """決定一次請求的 (狀態碼, 標頭, 內容)"""
+        roll, variant = self._roll()
+        if roll < self.rate_429:
+            body = json.dumps({'error': {'code': 429, 'message': 'Quota exceeded for quota metric '
+                                         "'Queries' and limit 'Queries per minute'", 'status': 'RESOURCE_EXHAUSTED'}})
+            return 429, {'Retry-After': str(self.retry_after)}, body.encode()
+        if roll < self.rate_429 + self.rate_500:
+            body = json.dumps({'error': {'code': 500, 'message': 'Lighthouse returned error', 'status': 'INTERNAL'}})
+            return 500, {}, body.encode()
+
+        url = query.get('url', ['https://example.com/'])[0]
+        if 'fields' in query:
+            categories = query.get('category') or CATEGORY_KEYS
+            document = project_response(self._documents[variant], categories)
+            document['id'] = url
+            return 200, {}, json.dumps(document).encode()
+        return 200, {}, self._full[variant]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(server.sample_latency())
+                status, headers, body = server.respond(parse_qs(urlsplit(self.path).query))
+                server._count('ok' if status == 200 else str(status), len(body))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-psi-server', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        """在目前的執行緒處理請求，直到按下 Ctrl+C"""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', choices=LATENCY_DISTRIBUTIONS, default='lognormal', help='延遲分布')
+    parser.add_argument('--latency-ms', type=float, default=300, help='延遲中位數（毫秒）')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='lognormal 分布的 sigma')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='回傳 429 的機率')
+    parser.add_argument('--rate-500', type=float, default=0.0, help='回傳 500 的機率')
+    parser.add_argument('--size-kb', type=int, default=1500, help='完整回應的大小（KB）')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = FakePageSpeedServer(args.host, args.port, latency=args.latency, latency_ms=args.latency_ms,
+                                 latency_sigma=args.latency_sigma, rate_429=args.rate_429, rate_500=args.rate_500,
+                                 size_kb=args.size_kb, seed=args.seed)
+    print(f"假 PageSpeed API 已啟動：{server.url}（PAGESPEED_API_URL={server.url}）", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
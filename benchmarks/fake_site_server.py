@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""本機的測試網站，用來驗證增量查詢的變更檢查：/page/<n> 回傳帶 ETag 與 Last-Modified 的 HTML
+
+    python benchmarks/fake_site_server.py --port 8766 --pages 1000 --no-etag
+
+change(n) 可讓指定頁面的內容改變；每次回應都會帶不同的 nonce，內容雜湊需忽略它。
+"""
+
+import argparse
+import threading
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeSiteServer:
+    """以執行緒處理請求的測試網站
+
+    etag / last_modified 為 False 時不送出對應的標頭，只能以內容雜湊判斷是否變更。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, pages=100, etag=True, last_modified=True):
+        self.pages = pages
+        self.etag = etag
+        self.last_modified = last_modified
+        self._versions = {}
+        self._modified_at = {}
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, '200': 0, '304': 0, '404': 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def page_url(self, n):
+        return f"{self.url}page/{n}"
+
+    def change(self, n):
+        """讓第 n 頁的內容改變"""
+        with self._lock:
+            self._versions[n] = self._versions.get(n, 0) + 1
+            self._modified_at[n] = formatdate(usegmt=True)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats[key] += 1
+
+    def respond(self, path, headers):
+        """決定一次請求的 (狀態碼, 標頭, 內容)"""
+        try:
+            n = int(path.rstrip('/').rsplit('/', 1)[-1])
+        except ValueError:
+            n = -1
+        if not path.startswith('/page/') or not 0 <= n < self.pages:
+            return 404, {}, b'not found'
+        with self._lock:
+            version = self._versions.get(n, 0)
+            modified_at = self._modified_at.get(n, 'Mon, 01 Jan 2024 00:00:00 GMT')
+        response_headers = {}
+        if self.etag:
+            response_headers['ETag'] = f'"p{n}-v{version}"'
+            if headers.get('If-None-Match') == response_headers['ETag']:
+                return 304, response_headers, b''
+        if self.last_modified:
+            response_headers['Last-Modified'] = modified_at
+            if not self.etag and headers.get('If-Modified-Since') == modified_at:
+                return 304, response_headers, b''
+        body = (f'<!doctype html><html><head><script nonce="{uuid.uuid4().hex}">var v = {version};</script>'
+                f'</head><body><h1>Page {n}</h1><p>version {version}</p></body></html>')
+        return 200, response_headers, body.encode()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, headers, body = server.respond(self.path, self.headers)
+                server._count(str(status))
+                self.send_response(status)
+                if status != 304:
+                    self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                    self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-site-server', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        """在目前的執行緒處理請求，直到按下 Ctrl+C"""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--no-etag', action='store_true', help='不送出 ETag 標頭')
+    parser.add_argument('--no-last-modified', action='store_true', help='不送出 Last-Modified 標頭')
+    args = parser.parse_args()
+
+    server = FakeSiteServer(args.host, args.port, pages=args.pages, etag=not args.no_etag,
+                            last_modified=not args.no_last_modified)
+    print(f"測試網站已啟動：{server.page_url(0)} ~ {server.page_url(args.pages - 1)}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""產生與 PageSpeed Insights v5 回應結構相近的假資料，供基準測試與本機假伺服器使用"""
+
+import base64
+import random
+
+CATEGORY_KEYS = ['performance', 'accessibility', 'best-practices', 'seo']
+METRIC_AUDITS = ['largest-contentful-paint', 'first-contentful-paint', 'total-blocking-time',
+                 'cumulative-layout-shift', 'speed-index', 'interactive']
+FIELD_METRICS = {
+    'LARGEST_CONTENTFUL_PAINT_MS': (1200, 6000),
+    'INTERACTION_TO_NEXT_PAINT': (50, 600),
+    'CUMULATIVE_LAYOUT_SHIFT_SCORE': (0, 40),
+    'FIRST_CONTENTFUL_PAINT_MS': (800, 4000),
+}
+
+
+def _screenshot(rng, size):
+    return 'data:image/jpeg;base64,' + base64.b64encode(rng.randbytes(size)).decode()
+
+
+def _audit(rng, audit_id, items):
+    return {
+        'id': audit_id,
+        'title': audit_id.replace('-', ' ').title(),
+        'description': 'Lorem ipsum dolor sit amet. ' * 4,
+        'score': round(rng.random(), 2),
+        'scoreDisplayMode': 'numeric',
+        'numericValue': rng.uniform(0, 5000),
+        'displayValue': f"{rng.uniform(0, 5):.1f} s",
+        'details': {
+            'type': 'table',
+            'headings': [{'key': 'url', 'valueType': 'url'}, {'key': 'totalBytes', 'valueType': 'bytes'}],
+            'items': [{'url': f"https://cdn.example.com/asset/{audit_id}/{i}.js",
+                       'totalBytes': rng.randint(1000, 500000),
+                       'wastedBytes': rng.randint(0, 100000),
+                       'wastedMs': rng.uniform(0, 800)} for i in range(items)],
+        },
+    }
+
+
+def make_lighthouse_response(url, size_kb=1500, seed=None):
+    """產生一份大約 size_kb KB 的 Lighthouse 回應（dict）
+
+    大部分體積來自截圖（base64）與稽核明細，與真實回應的組成相近。
+    """
+    rng = random.Random(seed if seed is not None else url)
+    screenshot_bytes = max(1, size_kb * 1024 // 3)
+    audit_count = 150
+    items_per_audit = max(1, (size_kb * 1024 - screenshot_bytes * 4 // 3) // (audit_count * 160))
+
+    audits = {audit_id: _audit(rng, audit_id, items_per_audit) for audit_id in METRIC_AUDITS}
+    for i in range(audit_count - len(METRIC_AUDITS)):
+        audits[f"audit-{i}"] = _audit(rng, f"audit-{i}", items_per_audit)
+    audits['cumulative-layout-shift']['numericValue'] = rng.uniform(0, 0.4)
+    audits['final-screenshot'] = {'id': 'final-screenshot', 'details': {'data': _screenshot(rng, screenshot_bytes // 2)}}
+    audits['screenshot-thumbnails'] = {'id': 'screenshot-thumbnails', 'details': {'items': [
+        {'timing': i * 300, 'data': _screenshot(rng, screenshot_bytes // 20)} for i in range(10)
+    ]}}
+
+    metrics = {name: {'percentile': rng.randint(low, high), 'category': rng.choice(['FAST', 'AVERAGE', 'SLOW'])}
+               for name, (low, high) in FIELD_METRICS.items()}
+    return {
+        'id': url,
+        'loadingExperience': {'id': url, 'metrics': metrics, 'overall_category': 'AVERAGE'},
+        'originLoadingExperience': {'id': url, 'metrics': metrics, 'overall_category': 'AVERAGE'},
+        'lighthouseResult': {
+            'requestedUrl': url,
+            'finalUrl': url,
+            'lighthouseVersion': '12.0.0',
+            'categories': {key: {'id': key, 'title': key, 'score': round(rng.random(), 2),
+                                 'auditRefs': [{'id': audit_id, 'weight': 1} for audit_id in list(audits)[:40]]}
+                           for key in CATEGORY_KEYS},
+            'audits': audits,
+            'fullPageScreenshot': {'screenshot': {'data': _screenshot(rng, screenshot_bytes // 4),
+                                                  'width': 412, 'height': 3000}},
+            'i18n': {'rendererFormattedStrings': {f"key{i}": 'text ' * 5 for i in range(100)}},
+        },
+        'analysisUTCTimestamp': '2024-01-01T00:00:00.000Z',
+    }
+
+
+def project_response(document, categories=CATEGORY_KEYS):
+    """模擬 API 的 fields 參數（partial response），只保留投影欄位"""
+    lighthouse = document['lighthouseResult']
+    return {
+        'lighthouseResult': {
+            'categories': {key: {'score': lighthouse['categories'][key]['score']}
+                           for key in categories if key in lighthouse['categories']},
+            'audits': {key: {'numericValue': lighthouse['audits'][key]['numericValue']}
+                       for key in METRIC_AUDITS[:4]},
+        },
+        'loadingExperience': {'metrics': {name: {'percentile': metric['percentile']}
+                                          for name, metric in document['loadingExperience']['metrics'].items()}},
+    }
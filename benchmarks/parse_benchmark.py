@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""比較 PageSpeed 回應解析方式的記憶體與耗時
+
+    python benchmarks/parse_benchmark.py [--sizes 500 1500 4000] [--repeat 5] [--json]
+
+比較項目：
+  json-full        原本的 response.json()：完整建立物件樹後取出分數
+  orjson-full      orjson 完整解析（若有安裝）
+  ijson-stream     以 ijson 串流投影（若有安裝）
+  projected        請求時帶 fields 參數，伺服器只回傳需要的欄位後再解析
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pagespeed_api  # noqa: E402
+from benchmarks.lighthouse_fixture import make_lighthouse_response, project_response  # noqa: E402
+
+
+def old_parse(content):
+    """原本 get_pagespeed_insights 的做法"""
+    result = json.loads(content)
+    categories = result['lighthouseResult']['categories']
+    return {key: categories[key]['score'] * 100 for key in categories}
+
+
+def measure(parse, content, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(content)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    parse(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings) * 1000, peak / 1024 / 1024
+
+
+def with_backend(ijson_module, json_module):
+    def parse(content):
+        saved = pagespeed_api.ijson, pagespeed_api._json_backend
+        pagespeed_api.ijson, pagespeed_api._json_backend = ijson_module, json_module
+        try:
+            return pagespeed_api.extract_fields(content)
+        finally:
+            pagespeed_api.ijson, pagespeed_api._json_backend = saved
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1500, 4000], help='回應大小（KB）')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    args = parser.parse_args()
+
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+    rows = []
+    for size_kb in args.sizes:
+        document = make_lighthouse_response('https://example.com/', size_kb=size_kb, seed=size_kb)
+        full = json.dumps(document).encode()
+        projected = json.dumps(project_response(document)).encode()
+
+        cases = [('json-full', old_parse, full), ('json-extract', with_backend(None, json), full)]
+        if orjson is not None:
+            cases.append(('orjson-full', with_backend(None, orjson), full))
+        if ijson is not None:
+            cases.append(('ijson-stream', with_backend(ijson, json), full))
+        cases.append(('projected', with_backend(None, orjson or json), projected))
+
+        for name, parse, content in cases:
+            elapsed_ms, peak_mb = measure(parse, content, args.repeat)
+            rows.append({'size_kb': size_kb, 'method': name, 'payload_bytes': len(content),
+                         'ms': round(elapsed_ms, 3), 'peak_mb': round(peak_mb, 3)})
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'size_kb':>8} {'method':<14} {'payload':>12} {'ms':>10} {'peak MB':>10}")
+    for row in rows:
+        print(f"{row['size_kb']:>8} {row['method']:<14} {row['payload_bytes']:>12,} {row['ms']:>10.3f} {row['peak_mb']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""可重複執行的效能基準測試，結果輸出成 JSON 報告，方便比較不同 commit 的效能
+
+    python benchmarks/run_benchmarks.py -o bench.json
+    python benchmarks/run_benchmarks.py --suites tags --tag-rows 100000 1000000 10000000
+    python benchmarks/run_benchmarks.py -o new.json --compare old.json
+
+測試項目：
+  fetch     以本機假 API 伺服器測量批次查詢（get_pagespeed_insights + with_retries + run_batch）的每秒網址數
+  tags      process_tags（count_tags + tags_to_frame）在不同列數下的吞吐量，以及多行程版本
+  workbook  不同大小 Excel 的工作表名稱、預覽與整張讀取耗時
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import pagespeed_api  # noqa: E402
+from benchmarks.fake_psi_server import LATENCY_DISTRIBUTIONS, FakePageSpeedServer  # noqa: E402
+from pagespeed_batch import run_batch, with_retries  # noqa: E402
+from tag_counter import count_chunks_parallel, count_tags, tags_to_frame  # noqa: E402
+from workbook_cache import WorkbookCache  # noqa: E402
+
+SUITES = ['fetch', 'tags', 'workbook']
+TAG_VOCABULARY = [f"tag{i}" for i in range(500)]
+
+
+def best_of(fn, repeat):
+    """執行 repeat 次，回傳最短耗時（秒）與最後一次的回傳值"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def bench_fetch(args):
+    rows = []
+    for workers in args.workers:
+        with FakePageSpeedServer(latency=args.latency, latency_ms=args.latency_ms, rate_429=args.rate_429,
+                                 rate_500=args.rate_500, retry_after=0, size_kb=args.size_kb, seed=0) as server:
+            saved_url, pagespeed_api.API_URL = pagespeed_api.API_URL, server.url
+            pagespeed_api.configure_session(pool_size=max(workers, pagespeed_api.DEFAULT_POOL_SIZE))
+            try:
+                request = with_retries(lambda url: pagespeed_api.get_pagespeed_insights(url, 'benchmark'),
+                                       max_retries=3, base_delay=0.01, max_delay=0.1)
+                urls = [f"https://example.com/page/{i}" for i in range(args.urls)]
+                started = time.perf_counter()
+                errors = sum(error is not None for _, _, error in run_batch(urls, request, max_workers=workers))
+                elapsed = time.perf_counter() - started
+            finally:
+                pagespeed_api.API_URL = saved_url
+            rows.append({
+                'suite': 'fetch', 'case': f"workers={workers}", 'workers': workers, 'urls': args.urls,
+                'seconds': round(elapsed, 4), 'urls_per_second': round(args.urls / elapsed, 2),
+                'errors': errors, 'requests': server.stats['requests'],
+                'responses_429': server.stats['429'], 'responses_500': server.stats['500'],
+            })
+    return rows
+
+
+def make_tag_values(rows, seed=0):
+    rng = random.Random(seed)
+    pool = [','.join(rng.sample(TAG_VOCABULARY, rng.randint(1, 5))) for _ in range(10000)]
+    return pd.Series([pool[i % len(pool)] for i in range(rows)], dtype=object)
+
+
+def bench_tags(args):
+    rows = []
+    for n in args.tag_rows:
+        values = make_tag_values(n)
+        df = pd.DataFrame({'tags': values})
+        elapsed, result = best_of(lambda: tags_to_frame(count_tags(df['tags'])), args.repeat)
+        rows.append({'suite': 'tags', 'case': f"process_tags rows={n}", 'rows': n, 'seconds': round(elapsed, 4),
+                     'rows_per_second': round(n / elapsed, 1), 'unique_tags': len(result)})
+
+        chunksize = max(1, n // (os.cpu_count() or 1) // 4)
+
+        def chunks():
+            return (values.iloc[i:i + chunksize] for i in range(0, n, chunksize))
+
+        elapsed, _ = best_of(lambda: count_chunks_parallel(chunks(), processes=args.processes), args.repeat)
+        rows.append({'suite': 'tags', 'case': f"parallel rows={n}", 'rows': n, 'seconds': round(elapsed, 4),
+                     'rows_per_second': round(n / elapsed, 1), 'processes': args.processes or os.cpu_count()})
+    return rows
+
+
+def make_workbook(rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('urls')
+    sheet.append(['url'])
+    for i in range(rows):
+        sheet.append([f"https://example.com/page/{i}"])
+    workbook.create_sheet('other').append(['note'])
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def bench_workbook(args):
+    rows = []
+    for n in args.workbook_rows:
+        data = make_workbook(n)
+
+        def ingest(cache):
+            upload = BytesIO(data)
+            names = cache.sheet_names(upload)
+            cache.preview(upload, names[0])
+            return cache.read_sheet(upload, names[0])
+
+        cold, df = best_of(lambda: ingest(WorkbookCache()), args.repeat)
+        cache = WorkbookCache()
+        ingest(cache)
+        warm, _ = best_of(lambda: ingest(cache), args.repeat)
+        baseline, _ = best_of(lambda: pd.read_excel(BytesIO(data), sheet_name=None), args.repeat)
+        rows.append({'suite': 'workbook', 'case': f"rows={n}", 'rows': n, 'bytes': len(data),
+                     'seconds': round(cold, 4), 'warm_seconds': round(warm, 6),
+                     'read_all_sheets_seconds': round(baseline, 4), 'rows_read': len(df)})
+    return rows
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pd.__version__,
+    }
+
+
+def compare(report, baseline):
+    """以 suite + case 對應兩份報告，列出耗時變化（負值表示變快）"""
+    previous = {(row['suite'], row['case']): row for row in baseline['results']}
+    for row in report['results']:
+        old = previous.get((row['suite'], row['case']))
+        if old and old.get('seconds'):
+            change = (row['seconds'] - old['seconds']) / old['seconds'] * 100
+            print(f"{row['suite']:<9} {row['case']:<28} {old['seconds']:>10.4f}s -> {row['seconds']:>10.4f}s "
+                  f"{change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=SUITES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--urls', type=int, default=200, help='fetch：每次查詢的網址數')
+    parser.add_argument('--workers', type=int, nargs='+', default=[4, 16], help='fetch：同時查詢數量')
+    parser.add_argument('--latency', choices=LATENCY_DISTRIBUTIONS, default='lognormal', help='fetch：假伺服器的延遲分布')
+    parser.add_argument('--latency-ms', type=float, default=50, help='fetch：延遲中位數（毫秒）')
+    parser.add_argument('--rate-429', type=float, default=0.02)
+    parser.add_argument('--rate-500', type=float, default=0.01)
+    parser.add_argument('--size-kb', type=int, default=200, help='fetch：完整回應大小（KB）')
+    parser.add_argument('--tag-rows', type=int, nargs='+', default=[100000, 1000000],
+                        help='tags：資料列數，可加上 10000000')
+    parser.add_argument('--processes', type=int, help='tags：多行程版本的行程數')
+    parser.add_argument('--workbook-rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('-o', '--output', help='JSON 報告路徑，預設輸出到標準輸出')
+    parser.add_argument('--compare', metavar='BASELINE', help='與先前的 JSON 報告比較')
+    args = parser.parse_args()
+
+    runners = {'fetch': bench_fetch, 'tags': bench_tags, 'workbook': bench_workbook}
+    results = []
+    for suite in args.suites:
+        print(f"執行 {suite}…", file=sys.stderr, flush=True)
+        results.extend(runners[suite](args))
+
+    report = {'environment': environment(), 'parameters': vars(args), 'results': results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""增量查詢：先以條件式請求（ETag / Last-Modified）或頁面內容雜湊檢查網址是否變更，
+沒有變更的網址沿用上次的分數，只把變更或過期的網址送去 PageSpeed 查詢"""
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from pagespeed_api import get_session
+from pagespeed_batch import run_batch
+from pagespeed_cache import make_cache_key, normalize_url
+from perf_metrics import METRICS
+
+DEFAULT_STATE_PATH = os.environ.get('PAGESPEED_STATE_PATH', 'pagespeed_state.sqlite')
+# 即使頁面沒有變更，超過這個時間也重新查詢（PageSpeed 的實際使用者資料會隨時間變動）
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_CHECK_WORKERS = 8
+DEFAULT_CHECK_TIMEOUT = 30
+# 計算雜湊最多讀取的內容大小
+MAX_HASH_BYTES = 5 * 1024 * 1024
+
+# 每次請求都會不同、但不代表內容變更的片段
+_VOLATILE = re.compile(rb'\snonce="[^"]*"|<meta[^>]+name="csrf-token"[^>]*>|<input[^>]+name="[^"]*csrf[^"]*"[^>]*>',
+                       re.I)
+_WHITESPACE = re.compile(rb'\s+')
+
+
+def content_hash(content):
+    """頁面內容的雜湊值；先去除 nonce、CSRF token 等每次請求都不同的片段並合併空白"""
+    content = _WHITESPACE.sub(b' ', _VOLATILE.sub(b'', content))
+    return hashlib.sha256(content).hexdigest()
+
+
+def check_page(url, previous=None, timeout=DEFAULT_CHECK_TIMEOUT):
+    """以條件式請求檢查頁面，回傳目前的 validators（etag、last_modified、content_hash）
+
+    previous 為上次記錄的 validators；伺服器回應 304 時沿用上次的內容雜湊，不下載內容。
+    """
+    headers = {}
+    if previous:
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+    with METRICS.timer('page_check_seconds'):
+        response = get_session().get(url, headers=headers, timeout=timeout, stream=True)
+        with response:
+            if response.status_code == 304 and previous:
+                return {
+                    'etag': response.headers.get('ETag') or previous.get('etag'),
+                    'last_modified': response.headers.get('Last-Modified') or previous.get('last_modified'),
+                    'content_hash': previous.get('content_hash'),
+                }
+            response.raise_for_status()
+            content = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) >= MAX_HASH_BYTES:
+                    break
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content_hash': content_hash(bytes(content)),
+    }
+
+
+class PageStateStore:
+    """增量查詢的狀態（SQLite 單一檔案）
+
+    pages 記錄每個網址最後一次檢查時的 validators；audits 記錄每個查詢組合
+    （網址、策略、類別、語系）最後一次實際查詢的分數，以及當時的內容雜湊。
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                ' url TEXT PRIMARY KEY,'
+                ' etag TEXT,'
+                ' last_modified TEXT,'
+                ' content_hash TEXT,'
+                ' checked_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS audits ('
+                ' key TEXT PRIMARY KEY,'
+                ' content_hash TEXT,'
+                ' result TEXT NOT NULL,'
+                ' audited_at REAL NOT NULL)'
+            )
+
+    def page(self, url):
+        """取得網址上次的 validators，沒有則回傳 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT etag, last_modified, content_hash FROM pages WHERE url = ?', (normalize_url(url),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'content_hash': row[2]}
+
+    def save_page(self, url, validators):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, checked_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (normalize_url(url), validators.get('etag'), validators.get('last_modified'),
+                 validators.get('content_hash'), time.time())
+            )
+
+    def audit(self, url, strategy, categories, locale=None):
+        """取得查詢組合上次的分數與當時的內容雜湊，沒有則回傳 None"""
+        key = make_cache_key(url, strategy, categories, locale)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT content_hash, result, audited_at FROM audits WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'content_hash': row[0], 'result': json.loads(row[1]), 'audited_at': row[2]}
+
+    def save_audit(self, url, strategy, categories, content_hash, result, locale=None):
+        """記錄一次實際查詢的結果與查詢時頁面的內容雜湊"""
+        key = make_cache_key(url, strategy, categories, locale)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO audits (key, content_hash, result, audited_at) VALUES (?, ?, ?, ?)',
+                (key, content_hash, json.dumps(result, ensure_ascii=False), time.time())
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM audits').fetchone()[0]
+
+
+class ChangeDetector:
+    """一次增量查詢的變更檢查，項目為 AuditTask（網址 × 策略 × 語系 × 類別）
+
+        items = detector.check_all(tasks)   # 平行檢查，依完成順序產出項目
+        result = detector.carried(task)     # 沒有變更的項目回傳上次的結果，否則為 None
+        detector.save(task, result)         # 實際查詢後記錄新的分數
+
+    相鄰且網址相同的項目（例如同一頁的 mobile 與 desktop）只檢查一次頁面。
+    檢查失敗（例如頁面暫時無法連線）時視為變更，交由 PageSpeed 查詢。
+    """
+
+    def __init__(self, store, max_age=DEFAULT_MAX_AGE, max_workers=DEFAULT_CHECK_WORKERS,
+                 timeout=DEFAULT_CHECK_TIMEOUT):
+        self.store = store
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.counts = {'unchanged': 0, 'changed': 0, 'expired': 0, 'new': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._carried = {}
+
+    def _outcome(self, task, current_hash):
+        if current_hash is None:
+            return 'failed', None
+        previous = self.store.audit(task.url, task.strategy, task.categories, task.locale)
+        if previous is None:
+            return 'new', None
+        if previous['content_hash'] != current_hash:
+            return 'changed', None
+        if time.time() - previous['audited_at'] > self.max_age:
+            return 'expired', None
+        return 'unchanged', previous['result']
+
+    def check(self, tasks):
+        """檢查同一個網址的一組項目，回傳各項目的結果（unchanged / changed / expired / new / failed）"""
+        url = tasks[0].url
+        try:
+            validators = check_page(url, self.store.page(url), timeout=self.timeout)
+            self.store.save_page(url, validators)
+            current_hash = validators['content_hash']
+        except Exception:
+            current_hash = None
+
+        outcomes = []
+        for task in tasks:
+            outcome, result = self._outcome(task, current_hash)
+            with self._lock:
+                self.counts[outcome] += 1
+                if result is not None:
+                    self._carried[task] = {**result, 'url': task.url}
+                else:
+                    self._hashes[task] = current_hash
+            outcomes.append(outcome)
+        return outcomes
+
+    def check_all(self, tasks):
+        """以 max_workers 個執行緒平行檢查，依完成順序逐一產出項目"""
+        groups = (list(group) for _, group in itertools.groupby(tasks, key=lambda task: task.url))
+        for group, _, _ in run_batch(groups, self.check, max_workers=self.max_workers):
+            yield from group
+
+    def carried(self, task):
+        """沒有變更的項目回傳上次的結果（只回傳一次），其他項目回傳 None"""
+        with self._lock:
+            return self._carried.pop(task, None)
+
+    def save(self, task, result):
+        with self._lock:
+            current_hash = self._hashes.pop(task, None)
+        self.store.save_audit(task.url, task.strategy, task.categories, current_hash, result, locale=task.locale)
+
+    def describe(self):
+        counts = self.counts
+        return (f"變更檢查：未變更 {counts['unchanged']} 個、已變更 {counts['changed']} 個、"
+                f"新網址 {counts['new']} 個、超過沿用期限 {counts['expired']} 個、檢查失敗 {counts['failed']} 個")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""不需 Streamlit 的命令列批次模式，可由 cron 等排程執行
+
+    # 查詢網址清單（每行一個網址，或 Excel/CSV 的第一欄），結果逐筆輸出
+    python cli.py pagespeed urls.txt --api-key KEY -o results.csv
+    cat urls.txt | python cli.py pagespeed - --format jsonl > results.jsonl
+
+    # 去除重複後每個網址樣板只抽樣 5 個，並輸出各樣板的估計分數
+    python cli.py pagespeed urls.xlsx --sample-per-group 5 --groups-output groups.csv -o results.csv
+
+    # mobile 與 desktop 在同一個佇列中一起查詢，另外輸出每個網址一列的寬表
+    python cli.py pagespeed urls.txt --strategy mobile --strategy desktop --wide-output wide.csv -o results.csv
+
+    # 每週監控：只重新查詢有變更的頁面
+    python cli.py pagespeed urls.txt --incremental --history -o results.csv
+
+    # 以多個行程統計標籤次數
+    python cli.py tags export.csv --column tags --processes 8 -o tags.xlsx
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+from audit_matrix import (STRATEGIES, VARIANT_COLUMNS, AuditTask, audit, build_variants, expand_tasks, pivot_wide,
+                          tag_result)
+from change_detector import DEFAULT_MAX_AGE, ChangeDetector, PageStateStore
+from pagespeed_api import DEFAULT_STRATEGY, METRIC_FIELDS, SCORE_FIELDS
+from pagespeed_batch import deadline_after, run_batch, with_retries
+from pagespeed_cache import ResultCache
+from pagespeed_checkpoint import RunCheckpoint
+from pagespeed_keys import DEFAULT_DAILY_QUOTA, ApiKeyPool, parse_api_keys
+from perf_metrics import METRICS
+from results_buffer import ResultBuffer
+from results_export import EXPORT_FORMATS, export_frame
+from score_history import ScoreHistory
+from sitemap_source import is_sitemap_location, iter_sitemap_urls
+from tag_counter import DEFAULT_CHUNKSIZE, DEFAULT_SEPARATOR, count_chunks_parallel, iter_file_values, tags_to_frame
+from url_sampling import DEFAULT_MIN_SIBLINGS, plan_sample
+
+RESULT_FIELDS = ['url'] + list(SCORE_FIELDS) + list(METRIC_FIELDS)
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def read_urls(paths):
+    """從檔案或標準輸入（-）讀取網址；Excel/CSV 取第一欄，sitemap（.xml / .xml.gz，可為網址）展開其中的網址，
+    其他檔案每行一個網址"""
+    for path in paths or ['-']:
+        if is_sitemap_location(path):
+            yield from iter_sitemap_urls([path])
+            continue
+        if path == '-':
+            lines = sys.stdin
+        elif path.lower().endswith(('.xlsx', '.xls', '.csv')):
+            df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path)
+            yield from (str(url).strip() for url in df[df.columns[0]].dropna())
+            continue
+        else:
+            lines = open(path, encoding='utf-8')
+        with lines:
+            yield from (line.strip() for line in lines if line.strip())
+
+
+class ResultWriter:
+    """逐筆寫出結果（CSV 或 JSON Lines），每筆都 flush，中途中斷也不會遺失已完成的結果"""
+
+    def __init__(self, out, fmt='csv', fields=RESULT_FIELDS):
+        self.out = out
+        self.fmt = fmt
+        if fmt == 'csv':
+            self._writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+            self._writer.writeheader()
+
+    def write(self, result):
+        if self.fmt == 'csv':
+            self._writer.writerow(result)
+        else:
+            self.out.write(json.dumps(result, ensure_ascii=False) + '\n')
+        self.out.flush()
+
+
+def run_pagespeed(args):
+    api_keys = parse_api_keys(args.api_key, os.environ.get('PAGESPEED_API_KEYS'))
+    if not api_keys:
+        log("請以 --api-key 或環境變數 PAGESPEED_API_KEYS 提供 API Key")
+        return 2
+
+    plan = None
+    if args.resume:
+        checkpoint = RunCheckpoint(args.resume)
+        if not checkpoint.exists():
+            log(f"找不到任務 {args.resume} 的檢查點")
+            return 2
+        if not checkpoint.load()[0]['complete']:
+            log("此任務的 sitemap 尚未讀完，只續跑已找到的網址；請在網頁介面續跑以重新讀取整份 sitemap")
+        completed_results, pending_keys = checkpoint.remaining()
+        tasks = [AuditTask.from_key(key) for key in pending_keys]
+    else:
+        urls = list(read_urls(args.inputs))
+        if not args.no_dedupe:
+            plan = plan_sample(urls, per_group=args.sample_per_group, min_siblings=args.min_siblings)
+            urls = plan.sampled_urls
+            log(plan.describe())
+        # 每個網址展開成查詢矩陣的所有組合，全部放進同一個佇列
+        variants = build_variants(args.strategy, args.locale,
+                                  [categories.split(',') for categories in args.categories or []])
+        tasks = expand_tasks(urls, variants)
+        # 檢查點記錄查詢矩陣的所有組合，每個項目的 AuditTask.key 也帶有各自的組合
+        checkpoint = RunCheckpoint.create([task.key for task in tasks], variants=variants)
+        completed_results = []
+    log(f"任務 ID：{checkpoint.run_id}（可用 --resume 續跑）")
+
+    # 查詢矩陣的結果加上組合欄位
+    matrix = (any(not task.is_default for task in tasks)
+              or any(result.get('variant', DEFAULT_STRATEGY) != DEFAULT_STRATEGY for result in completed_results))
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    writer = ResultWriter(out, args.format, RESULT_FIELDS + VARIANT_COLUMNS if matrix else RESULT_FIELDS)
+    # 輸出寬表或樣板估計時需要所有結果（含快取與檢查點）
+    keep_all = args.wide_output or (args.groups_output and plan is not None)
+    all_results = ResultBuffer() if keep_all else None
+
+    def write(result):
+        writer.write(result)
+        if all_results is not None:
+            all_results.append(result)
+
+    for result in completed_results:
+        write(result)
+
+    # 先從快取取出仍有效的結果，只查詢新的或過期的組合
+    cache = None if args.no_cache else ResultCache()
+    pending_tasks = []
+    for task in tasks:
+        cached = None
+        if cache is not None:
+            cached = cache.get(task.url, task.strategy, task.categories, ttl=args.cache_ttl * 3600,
+                               locale=task.locale)
+        if cached is not None:
+            cached = tag_result(task, cached)
+            write(cached)
+            checkpoint.record_later(task.key, cached)
+        else:
+            pending_tasks.append(task)
+    checkpoint.flush()
+
+    # 增量查詢：沒有變更的組合沿用上次的分數
+    detector = None
+    if args.incremental:
+        detector = ChangeDetector(PageStateStore(), max_age=args.max_age_days * 24 * 60 * 60)
+        changed_tasks = []
+        for task in detector.check_all(pending_tasks):
+            carried = detector.carried(task)
+            if carried is not None:
+                write(carried)
+                checkpoint.record_later(task.key, carried)
+            else:
+                changed_tasks.append(task)
+        checkpoint.flush()
+        pending_tasks = changed_tasks
+        log(detector.describe())
+    log(f"共 {len(tasks) + len(completed_results)} 個查詢，需查詢 {len(pending_tasks)} 個")
+
+    key_pool = ApiKeyPool(api_keys, rate_per_minute=args.rate, daily_quota=args.daily_quota)
+    deadline = deadline_after(args.deadline_minutes * 60)
+    request = key_pool.wrap(lambda task, api_key: audit(task, api_key, timeout=args.timeout), deadline=deadline)
+    request = with_retries(request, max_retries=args.retries, deadline=deadline)
+
+    fetched = ResultBuffer()
+    failed = 0
+    try:
+        for i, (task, result, error) in enumerate(run_batch(pending_tasks, request, max_workers=args.workers,
+                                                            deadline=deadline), start=1):
+            if error is not None:
+                failed += 1
+                log(f"分析 {task} 時發生錯誤: {str(error)}")
+                continue
+            write(result)
+            checkpoint.record(task.key, result)
+            if cache is not None:
+                cache.set(task.url, task.strategy, task.categories, result, locale=task.locale)
+            if detector is not None:
+                detector.save(task, result)
+            fetched.append(result)
+            if i % 100 == 0:
+                log(f"已完成 {i}/{len(pending_tasks)}")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if args.history and len(fetched):
+            ScoreHistory().append(fetched.to_frame(), run_id=checkpoint.run_id)
+
+    log(f"查詢完成，成功 {len(fetched)} 個，失敗 {failed} 個")
+    if all_results is not None:
+        wide = pivot_wide(all_results.to_frame())
+        if args.wide_output:
+            wide.to_csv(args.wide_output, index=False)
+            log(f"寬表已寫入 {args.wide_output}")
+        if args.groups_output and plan is not None:
+            plan.estimates(wide).to_csv(args.groups_output, index=False)
+            log(f"樣板估計已寫入 {args.groups_output}")
+    return 1 if failed else 0
+
+
+def run_tags(args):
+    def chunks(path):
+        if path == '-':
+            return iter_file_values(sys.stdin.buffer, 'stdin.csv', args.column, encoding=args.encoding,
+                                    chunksize=args.chunksize)
+        return iter_file_values(path, path, args.column, encoding=args.encoding, chunksize=args.chunksize)
+
+    # 所有檔案的批次串成同一個佇列，平行計數後合併
+    all_chunks = itertools.chain.from_iterable(chunks(path) for path in args.inputs or ['-'])
+    counts = count_chunks_parallel(all_chunks, sep=args.sep, processes=args.processes)
+    result_df = tags_to_frame(counts).reset_index()
+
+    fmt = args.output.rsplit('.', 1)[-1].lower() if args.output else 'csv'
+    if not args.output:
+        result_df.to_csv(sys.stdout, index=False)
+    elif fmt in EXPORT_FORMATS:
+        with export_frame(result_df, fmt) as exported, open(args.output, 'wb') as f:
+            shutil.copyfileobj(exported, f)
+    else:
+        log(f"不支援的輸出格式：{fmt}（可用 {', '.join(EXPORT_FORMATS)}）")
+        return 2
+    log(f"共 {len(result_df)} 個標籤")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metrics-file', help="結束時寫出耗時量測（.json 為 JSON，其他為 Prometheus 文字格式）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pagespeed = subparsers.add_parser('pagespeed', help="批次查詢 PageSpeed Insights")
+    pagespeed.add_argument('inputs', nargs='*', help="網址清單檔案或 sitemap，- 或省略表示標準輸入")
+    pagespeed.add_argument('--api-key', action='append', help="API Key，可重複指定以輪替多組 Key")
+    pagespeed.add_argument('--strategy', action='append', choices=STRATEGIES,
+                           help=f"查詢策略，可重複指定（例如 mobile 與 desktop），預設為 {DEFAULT_STRATEGY}")
+    pagespeed.add_argument('--locale', action='append', help="報告語系（例如 zh-TW），可重複指定")
+    pagespeed.add_argument('--categories', action='append',
+                           help="以逗號分隔的類別組合（例如 performance,seo），可重複指定；預設為全部類別")
+    pagespeed.add_argument('--workers', type=int, default=4, help="同時查詢數量")
+    pagespeed.add_argument('--rate', type=int, default=60, help="每組 API Key 每分鐘請求上限")
+    pagespeed.add_argument('--daily-quota', type=int, default=DEFAULT_DAILY_QUOTA, help="每組 API Key 每日配額")
+    pagespeed.add_argument('--retries', type=int, default=3, help="失敗重試次數")
+    pagespeed.add_argument('--timeout', type=int, default=60, help="單次請求逾時（秒）")
+    pagespeed.add_argument('--deadline-minutes', type=int, default=0, help="整體時限（分鐘，0 表示不限）")
+    pagespeed.add_argument('--cache-ttl', type=float, default=24, help="快取有效時間（小時）")
+    pagespeed.add_argument('--no-cache', action='store_true', help="不讀寫結果快取")
+    pagespeed.add_argument('--incremental', action='store_true',
+                           help="先檢查頁面是否變更（ETag / Last-Modified / 內容雜湊），沒有變更的沿用上次的分數")
+    pagespeed.add_argument('--max-age-days', type=float, default=DEFAULT_MAX_AGE / 86400,
+                           help="增量查詢時，上次查詢超過這個天數的頁面仍重新查詢")
+    pagespeed.add_argument('--history', action='store_true', help="將結果附加到歷史分數")
+    pagespeed.add_argument('--resume', metavar='RUN_ID', help="從檢查點續跑先前中斷的任務")
+    pagespeed.add_argument('--no-dedupe', action='store_true', help="不去除重複網址（追蹤參數、結尾斜線等）")
+    pagespeed.add_argument('--sample-per-group', type=int, default=0,
+                           help="每個網址樣板最多查詢幾個，0 表示全部查詢")
+    pagespeed.add_argument('--min-siblings', type=int, default=DEFAULT_MIN_SIBLINGS,
+                           help="同一層有幾個以上的頁面時視為同一樣板")
+    pagespeed.add_argument('--groups-output', help="樣板估計的 CSV 輸出路徑（不適用於 --resume）")
+    pagespeed.add_argument('--format', default='csv', choices=['csv', 'jsonl'])
+    pagespeed.add_argument('--wide-output', help="每個網址一列的寬表 CSV 輸出路徑（查詢矩陣時使用）")
+    pagespeed.add_argument('-o', '--output', help="輸出檔案，預設輸出到標準輸出")
+    pagespeed.set_defaults(run=run_pagespeed)
+
+    tags = subparsers.add_parser('tags', help="統計標籤次數")
+    tags.add_argument('inputs', nargs='*', help="CSV 或 Excel 檔案，- 或省略表示從標準輸入讀取 CSV")
+    tags.add_argument('--column', required=True, help="標籤欄位名稱")
+    tags.add_argument('--sep', default=DEFAULT_SEPARATOR, help="標籤分隔字元")
+    tags.add_argument('--encoding', default='utf-8', help="CSV 檔案編碼")
+    tags.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="每批讀取的列數")
+    tags.add_argument('--processes', type=int, help="平行行程數，預設為 CPU 核心數")
+    tags.add_argument('-o', '--output', help="輸出檔案（.csv / .xlsx / .parquet），預設輸出 CSV 到標準輸出")
+    tags.set_defaults(run=run_tags)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.run(args)
+    finally:
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
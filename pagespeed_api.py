@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""PageSpeed Insights API 共用查詢模組：所有工具共用一個 keep-alive 連線池"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from perf_metrics import METRICS
+
+# 選用：orjson 解析較快；ijson 可串流投影欄位，不必建立完整的物件樹
+try:
+    import orjson as _json_backend
+except ImportError:
+    import json as _json_backend
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# 可用環境變數指向本機的假伺服器（benchmarks/fake_psi_server.py）做測試
+API_URL = os.environ.get('PAGESPEED_API_URL', 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed')
+DEFAULT_STRATEGY = 'mobile'
+DEFAULT_CATEGORIES = ['accessibility', 'best-practices', 'performance', 'seo']
+DEFAULT_TIMEOUT = 60
+DEFAULT_POOL_SIZE = int(os.environ.get('PAGESPEED_POOL_SIZE', 32))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _new_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure_session(pool_size=DEFAULT_POOL_SIZE):
+    """重新建立共用的 Session，連線池大小應不小於同時進行的請求數"""
+    global _session
+    with _session_lock:
+        previous, _session = _session, _new_session(pool_size)
+    if previous is not None:
+        previous.close()
+    return _session
+
+
+def get_session():
+    """取得共用的 Session，重複使用 DNS 查詢、TCP 連線與 TLS 交握"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_session(DEFAULT_POOL_SIZE)
+        return _session
+
+
+# 每個輸出欄位對應回應中的路徑與換算倍率；只有這些欄位會被解析出來
+SCORE_FIELDS = {
+    'performance': ('performance', 100),
+    'accessibility': ('accessibility', 100),
+    'best_practices': ('best-practices', 100),
+    'seo': ('seo', 100),
+}
+METRIC_FIELDS = {
+    'lcp_ms': (('lighthouseResult', 'audits', 'largest-contentful-paint', 'numericValue'), 1),
+    'fcp_ms': (('lighthouseResult', 'audits', 'first-contentful-paint', 'numericValue'), 1),
+    'tbt_ms': (('lighthouseResult', 'audits', 'total-blocking-time', 'numericValue'), 1),
+    'cls': (('lighthouseResult', 'audits', 'cumulative-layout-shift', 'numericValue'), 1),
+    'field_lcp_p75_ms': (('loadingExperience', 'metrics', 'LARGEST_CONTENTFUL_PAINT_MS', 'percentile'), 1),
+    'field_inp_p75_ms': (('loadingExperience', 'metrics', 'INTERACTION_TO_NEXT_PAINT', 'percentile'), 1),
+    'field_cls_p75': (('loadingExperience', 'metrics', 'CUMULATIVE_LAYOUT_SHIFT_SCORE', 'percentile'), 0.01),
+    'field_fcp_p75_ms': (('loadingExperience', 'metrics', 'FIRST_CONTENTFUL_PAINT_MS', 'percentile'), 1),
+}
+
+
+def projected_fields(categories=DEFAULT_CATEGORIES):
+    """產生 API 的 fields 參數（partial response），讓伺服器只回傳需要的欄位"""
+    score_fields = ','.join(f"{category}/score" for category in categories)
+    audits = ','.join(sorted({f"{path[2]}/numericValue" for path, _ in METRIC_FIELDS.values()
+                              if path[1] == 'audits'}))
+    return (f"lighthouseResult(categories({score_fields}),audits({audits})),"
+            f"loadingExperience/metrics/*/percentile")
+
+
+def build_params(url, api_key, strategy=DEFAULT_STRATEGY, categories=DEFAULT_CATEGORIES, project=True, locale=None):
+    params = {
+        'url': url,
+        'key': api_key,
+        'strategy': strategy,
+        'category': list(categories)
+    }
+    if locale:
+        params['locale'] = locale
+    if project:
+        params['fields'] = projected_fields(categories)
+    return params
+
+
+def field_paths(categories=DEFAULT_CATEGORIES):
+    """回傳 {路徑: (輸出欄位, 倍率)}"""
+    paths = {}
+    for name, (category, scale) in SCORE_FIELDS.items():
+        if category in categories:
+            paths[('lighthouseResult', 'categories', category, 'score')] = (name, scale)
+    for name, (path, scale) in METRIC_FIELDS.items():
+        paths[path] = (name, scale)
+    return paths
+
+
+def _project_stream(content, paths):
+    """以 ijson 逐一讀取 JSON 事件，只保留需要的值，不建立完整的物件樹"""
+    prefixes = {'.'.join(path): path for path in paths}
+    values = {}
+    for prefix, event, value in ijson.parse(content):
+        if prefix in prefixes and event in ('number', 'string', 'boolean', 'null'):
+            values[prefixes[prefix]] = value
+    return values
+
+
+def _project_document(result, paths):
+    values = {}
+    for path in paths:
+        node = result
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                break
+            node = node[key]
+        else:
+            values[path] = node
+    return values
+
+
+def extract_fields(content, categories=DEFAULT_CATEGORIES):
+    """從回應內容（bytes）取出設定的欄位
+
+    有安裝 ijson 時以串流方式投影；否則用 orjson（若有）或 json 解析後取值。
+    """
+    paths = field_paths(categories)
+    if ijson is not None:
+        values = _project_stream(content, paths)
+    else:
+        values = _project_document(_json_backend.loads(content), paths)
+    return {name: (_scaled(values[path], scale) if values.get(path) is not None else None)
+            for path, (name, scale) in paths.items()}
+
+
+def _scaled(value, scale):
+    """換算倍率；去除浮點誤差（例如 0.29 * 100 = 28.999999999999996），分數因此是整數值"""
+    value = float(value)
+    return value if scale == 1 else round(value * scale, 6)
+
+
+def parse_scores(url, content, categories=DEFAULT_CATEGORIES):
+    """從 API 回應取出各類別分數（0~100）與 Core Web Vitals 指標"""
+    fields = extract_fields(content, categories)
+    if all(fields.get(name) is None for name, (category, _) in SCORE_FIELDS.items() if category in categories):
+        raise ValueError("API 回應缺少 lighthouseResult 分數")
+    return {'url': url, **fields}
+
+
+def get_pagespeed_insights(url, api_key, timeout=DEFAULT_TIMEOUT, strategy=DEFAULT_STRATEGY,
+                           categories=DEFAULT_CATEGORIES, archive=None, locale=None):
+    """獲取 PageSpeed Insights 數據，失敗時拋出例外
+
+    提供 archive（ReportArchive）時會請求完整回應並封存，之後可離線重新擷取其他指標。
+    locale 為報告的語系（例如 zh-TW），未指定時由 API 決定。
+    """
+    params = build_params(url, api_key, strategy, categories, project=archive is None, locale=locale)
+    with METRICS.timer('pagespeed_request_seconds'):
+        response = get_session().get(API_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    with METRICS.timer('pagespeed_parse_seconds'):
+        result = parse_scores(url, response.content, categories)
+    if archive is not None:
+        archive.put(url, strategy, response.content, categories=categories, locale=locale)
+    return result
+
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""PageSpeed Insights 批次查詢引擎：並行請求、令牌桶限速、逾時重試與備援請求"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from perf_metrics import METRICS
+
+# 可重試的 HTTP 狀態碼；429/503 會優先參考 Retry-After
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_EXHAUSTED = object()
+
+
+class DeadlineExceeded(Exception):
+    """整批查詢已超過時限，未送出的請求不再執行"""
+
+    def __init__(self, message="超過整體時限，未查詢"):
+        super().__init__(message)
+
+
+class TokenBucket:
+    """令牌桶限速器，每 `per` 秒補充 `rate` 個令牌，最多累積 `capacity` 個"""
+
+    def __init__(self, rate, per=60.0, capacity=None):
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate 與 per 必須大於 0")
+        self.rate = float(rate)
+        self.per = float(per)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate / per))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def set_rate(self, rate):
+        """調整補充速率，已累積的令牌依原本的速率結算"""
+        if rate <= 0:
+            raise ValueError("rate 必須大於 0")
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            self.capacity = max(1.0, self.rate / self.per)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def try_acquire(self, tokens=1):
+        """嘗試取得令牌，成功回傳 0，否則回傳需要等待的秒數"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) * self.per / self.rate
+
+    def acquire(self, tokens=1):
+        """阻塞直到取得令牌"""
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+
+class LatencyTracker:
+    """記錄最近的請求耗時，用來估計延遲百分位數"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, q):
+        """回傳第 q 百分位（0~1）的耗時，沒有樣本時回傳 None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def is_overload_error(error):
+    """判斷錯誤是否代表 API 過載（429/503 或逾時），用於調降並行數量"""
+    if isinstance(error, requests.Timeout):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code in (429, 503)
+
+
+class AdaptiveConcurrency:
+    """AIMD 並行數量控制器
+
+    延遲與錯誤率正常時，每完成約一個並行上限的請求就把上限加 increase；
+    遇到 429/503 或逾時則乘上 decrease 大幅降低，並在一個延遲週期內不再重複降低。
+    延遲超過基準延遲的 latency_factor 倍時視為壅塞，暫停調升。
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, increase=1.0, decrease=0.5,
+                 latency_factor=2.0, window=60.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.window = window
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._in_flight = 0
+        self._latency = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._completions = deque()
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @METRICS.timed('concurrency_wait_seconds')
+    def acquire(self):
+        """等待直到進行中的請求數低於目前上限"""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency, error=None):
+        """回報一次請求的耗時與錯誤，並依 AIMD 規則調整上限"""
+        now = time.monotonic()
+        with self._condition:
+            self._in_flight -= 1
+            self._completions.append(now)
+            while self._completions and now - self._completions[0] > self.window:
+                self._completions.popleft()
+
+            if error is not None and is_overload_error(error):
+                if now - self._last_decrease > (self._latency or 0.0):
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease)
+                    self._last_decrease = now
+            elif error is None:
+                self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+                self._baseline = self._latency if self._baseline is None else min(self._baseline, self._latency)
+                if self._latency <= self._baseline * self.latency_factor:
+                    self._limit = min(float(self.max_limit), self._limit + self.increase / max(self._limit, 1.0))
+            self._condition.notify_all()
+
+    def throughput(self):
+        """最近 window 秒內每分鐘完成的請求數"""
+        with self._condition:
+            if not self._completions:
+                return 0.0
+            span = max(time.monotonic() - self._completions[0], 1.0)
+            return len(self._completions) / min(span, self.window) * 60
+
+    def wrap(self, fn):
+        """包裝 fn，每次呼叫都先取得並行名額並回報結果"""
+        def wrapper(*args, **kwargs):
+            self.acquire()
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.release(time.monotonic() - started, e)
+                raise
+            self.release(time.monotonic() - started)
+            return result
+        return wrapper
+
+
+def deadline_after(seconds):
+    """將「幾秒後」換算成 run_batch / with_retries 使用的時限；0 或 None 表示不限時"""
+    return time.monotonic() + seconds if seconds else None
+
+
+def retry_after_seconds(response):
+    """解析 Retry-After 標頭（秒數或 HTTP 日期），無法解析時回傳 None"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def with_retries(fn, max_retries=3, base_delay=1.0, max_delay=60.0, deadline=None):
+    """包裝 fn，遇到逾時、連線錯誤或可重試的 HTTP 狀態時以指數退避 + 隨機抖動重試
+
+    429/503 若帶有 Retry-After 則依其等待；等待後會超過 deadline 時直接拋出原本的例外。
+    """
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except (requests.Timeout, requests.ConnectionError, requests.HTTPError) as e:
+                response = getattr(e, 'response', None)
+                status = response.status_code if response is not None else None
+                if isinstance(e, requests.HTTPError) and status not in RETRY_STATUS_CODES:
+                    raise
+                if attempt >= max_retries:
+                    raise
+                delay = retry_after_seconds(response) if status in (429, 503) else None
+                if delay is None:
+                    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+    return wrapper
+
+
+def with_hedging(fn, tracker, percentile=0.95, min_samples=20, max_workers=8):
+    """包裝 fn，若呼叫耗時超過目前 p95 延遲，再送出一個備援請求並採用先成功的結果
+
+    樣本數不足 min_samples 時不會送出備援請求。成功呼叫的耗時會記錄到 tracker。
+    max_workers 為同時呼叫 wrapper 的執行緒數（例如 run_batch 的 max_workers）；
+    每個呼叫最多同時佔用兩個執行緒（原請求與備援請求），因此執行緒池開到兩倍，
+    備援請求不必排在它要競速的慢請求後面。不再使用時呼叫 wrapper.close() 釋放執行緒池。
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers * 2, thread_name_prefix='pagespeed-hedge')
+
+    def timed(*args, **kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        tracker.record(time.monotonic() - started)
+        return result
+
+    def wrapper(*args, **kwargs):
+        threshold = tracker.percentile(percentile) if len(tracker) >= min_samples else None
+        primary = executor.submit(timed, *args, **kwargs)
+        if threshold is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+
+        attempts = {primary, executor.submit(timed, *args, **kwargs)}
+        error = None
+        while attempts:
+            done, attempts = wait(attempts, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    # 不等待仍在進行的落後請求，它們完成後執行緒即結束
+    wrapper.close = lambda: executor.shutdown(wait=False)
+    return wrapper
+
+
+def run_batch(items, fetch, max_workers=4, rate_limiter=None, deadline=None):
+    """以執行緒池並行呼叫 fetch(item)，依完成順序逐筆產出 (item, result, error)
+
+    同時進行中的請求數不超過 max_workers；若提供 rate_limiter，
+    每次呼叫前都會先向它取得令牌。items 可以是任何可迭代物件，會逐步讀取。
+    超過 deadline（time.monotonic() 時間）後尚未開始的項目以 DeadlineExceeded 回報。
+    """
+    def task(item):
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceeded()
+        if rate_limiter is not None:
+            with METRICS.timer('rate_limit_wait_seconds'):
+                rate_limiter.acquire()
+        return fetch(item)
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+
+        def submit_next():
+            item = next(items, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                return False
+            pending[executor.submit(task, item)] = item
+            return True
+
+        for _ in range(max_workers):
+            if not submit_next():
+                break
+
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    error = future.exception()
+                    yield item, (None if error else future.result()), error
+                    submit_next()
+        finally:
+            # 提早中止時取消尚未開始的請求
+            for future in pending:
+                future.cancel()
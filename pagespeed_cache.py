@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""PageSpeed Insights 結果的本機快取（SQLite 單一檔案）"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_CACHE_PATH = os.environ.get('PAGESPEED_CACHE_PATH', 'pagespeed_cache.sqlite')
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 50000
+# 每寫入多少筆檢查一次筆數上限，避免每次寫入都掃描索引
+EVICT_EVERY = 100
+
+
+def normalize_url(url):
+    """正規化網址：小寫 scheme/host、去除預設埠號與 fragment、補上根路徑"""
+    parts = urlsplit(str(url).strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def make_cache_key(url, strategy, categories, locale=None):
+    """以正規化網址 + 策略 + 類別集合（+ 語系）組成快取鍵"""
+    parts = [normalize_url(url), strategy, ','.join(sorted(categories))]
+    if locale:
+        parts.append(locale)
+    return '|'.join(parts)
+
+
+class ResultCache:
+    """具 TTL 與 LRU 筆數上限的結果快取，可在多個執行緒間共用"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY,'
+                ' value TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' accessed_at REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)')
+
+    def get(self, url, strategy, categories, ttl=None, locale=None):
+        """取得未過期的快取結果，沒有則回傳 None"""
+        key = make_cache_key(url, strategy, categories, locale)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM results WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[1] > ttl:
+                return None
+            self._conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, url, strategy, categories, result, locale=None):
+        """寫入結果，超過筆數上限時淘汰最久未使用的項目"""
+        key = make_cache_key(url, strategy, categories, locale)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        """淘汰超過筆數上限、最久未使用的項目（呼叫端需持有鎖）"""
+        self._conn.execute(
+            'DELETE FROM results WHERE key IN ('
+            ' SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def purge_expired(self):
+        """刪除所有已過期的項目"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM results WHERE created_at < ?', (time.time() - self.ttl,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM results')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""查詢進度檢查點：每完成一個網址就追加寫入 JSONL 檔，中斷後可從檢查點續跑"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+DEFAULT_CHECKPOINT_DIR = os.environ.get('PAGESPEED_CHECKPOINT_DIR', 'pagespeed_runs')
+# record_later 累積到這個筆數或距上次寫入超過這個秒數時才寫入磁碟
+DEFAULT_RECORD_BATCH = 500
+DEFAULT_RECORD_INTERVAL = 1.0
+# 超過保留天數未更新的檢查點，建立新的檢查點時一併刪除
+DEFAULT_RETENTION_DAYS = float(os.environ.get('PAGESPEED_CHECKPOINT_RETENTION_DAYS', 30))
+
+# list_runs 的摘要快取：{檔案路徑: ((mtime, 大小), 摘要)}，檔案沒有變動時不重新解析
+_summaries = {}
+_summaries_lock = threading.Lock()
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+class RunCheckpoint:
+    """單次查詢的檢查點檔案
+
+    第一行記錄網址清單，之後每行是一筆完成的結果；網址來源是串流時（header 的 streaming 為 True），
+    陸續找到的網址以 urls 記錄追加，來源讀完時追加 end 記錄，沒有 end 記錄的串流任務視為未完成。
+    查詢矩陣的項目以 AuditTask.key 代替網址記錄。
+    檔案只會追加寫入，程序中途當掉最多遺失最後一行未寫完的資料。
+    """
+
+    def __init__(self, run_id, directory=DEFAULT_CHECKPOINT_DIR):
+        if not run_id.isalnum():
+            raise ValueError(f"無效的 run ID：{run_id}")
+        self.run_id = run_id
+        self.path = os.path.join(directory, f"{run_id}.jsonl")
+        self._lock = threading.Lock()
+        self._needs_newline = False
+        self._buffer_lock = threading.Lock()
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+
+    @classmethod
+    def create(cls, urls, directory=DEFAULT_CHECKPOINT_DIR, run_id=None, **meta):
+        """建立新的檢查點並寫入網址清單，同時刪除超過保留天數的舊檢查點"""
+        os.makedirs(directory, exist_ok=True)
+        prune_runs(directory)
+        checkpoint = cls(run_id or new_run_id(), directory)
+        header = {'type': 'run', 'run_id': checkpoint.run_id, 'created_at': time.time(), 'urls': list(urls), **meta}
+        with open(checkpoint.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        return checkpoint
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def source_path(self, index):
+        """第 index 個保存的來源檔案路徑（例如上傳的 sitemap），串流任務續跑時重新讀取"""
+        return os.path.join(os.path.dirname(self.path), f"{self.run_id}-{index}.source")
+
+    def save_source(self, index, data):
+        """保存來源檔案的內容（bytes），回傳檔案路徑"""
+        path = self.source_path(index)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def record(self, url, result):
+        """追加一筆完成的結果並立即寫入磁碟"""
+        self.record_many([(url, result)])
+
+    def record_many(self, items):
+        """一次追加多筆 (url, result)，只同步磁碟一次"""
+        self._append(''.join(
+            json.dumps({'type': 'result', 'url': url, 'result': result}, ensure_ascii=False) + '\n'
+            for url, result in items
+        ))
+
+    def record_later(self, url, result, batch_size=DEFAULT_RECORD_BATCH, interval=DEFAULT_RECORD_INTERVAL):
+        """暫存一筆結果，累積 batch_size 筆或超過 interval 秒才以 record_many 一次寫入
+
+        適合大量沿用的結果（例如快取命中），避免每筆都同步一次磁碟；結束時需呼叫 flush。
+        程序中途當掉最多遺失 interval 秒內暫存的結果，續跑時重新查詢即可。
+        """
+        with self._buffer_lock:
+            self._buffer.append((url, result))
+            if len(self._buffer) < batch_size and time.monotonic() - self._flushed_at < interval:
+                return
+        self.flush()
+
+    def flush(self):
+        """寫入 record_later 暫存的結果"""
+        with self._buffer_lock:
+            items, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+        self.record_many(items)
+
+    def add_urls(self, urls):
+        """追加陸續找到的網址（例如從 sitemap 串流讀取）"""
+        urls = list(urls)
+        if urls:
+            self._append(json.dumps({'type': 'urls', 'urls': urls}, ensure_ascii=False) + '\n')
+
+    def track(self, urls, batch_size=DEFAULT_RECORD_BATCH, interval=DEFAULT_RECORD_INTERVAL, key=None):
+        """逐一產出 urls，同時每 batch_size 個或每 interval 秒以 add_urls 記錄一次；key(item) 為記錄用的字串
+
+        urls 讀完時追加 end 記錄；中途停止（例如任務取消或程序當掉）則沒有，續跑時需重新讀取來源。
+        """
+        batch = []
+        flushed_at = time.monotonic()
+        try:
+            for url in urls:
+                batch.append(key(url) if key is not None else url)
+                if len(batch) >= batch_size or time.monotonic() - flushed_at >= interval:
+                    self.add_urls(batch)
+                    batch = []
+                    flushed_at = time.monotonic()
+                yield url
+            self.add_urls(batch)
+            batch = []
+            self._append(json.dumps({'type': 'end'}) + '\n')
+        finally:
+            self.add_urls(batch)
+
+    def _append(self, lines):
+        if not lines:
+            return
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            if self._needs_newline:
+                # 上次中斷時留下未寫完的行，先換行避免新資料接在後面
+                lines = '\n' + lines
+                self._needs_newline = False
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self):
+        """讀取檢查點，回傳 (header, {url: result})；略過損毀的行
+
+        header['urls'] 去除重複（續跑串流任務時會再次記錄相同的網址），
+        header['complete'] 表示網址清單是否完整（非串流任務，或串流來源已讀完）。
+        """
+        header = None
+        ended = False
+        completed = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                self._needs_newline = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('type') == 'run':
+                    header = record
+                elif record.get('type') == 'urls' and header is not None:
+                    header['urls'].extend(record['urls'])
+                elif record.get('type') == 'end':
+                    ended = True
+                elif record.get('type') == 'result':
+                    completed[record['url']] = record['result']
+        if header is None:
+            raise ValueError(f"檢查點 {self.run_id} 缺少網址清單")
+        header['urls'] = list(dict.fromkeys(header['urls']))
+        header['complete'] = ended or not header.get('streaming')
+        return header, completed
+
+    def remaining(self):
+        """回傳 (已完成的結果清單, 尚未完成的網址清單)；串流來源未讀完時清單只含已找到的網址"""
+        header, completed = self.load()
+        pending = [url for url in header['urls'] if url not in completed]
+        return list(completed.values()), pending
+
+
+def _summarize(checkpoint, signature):
+    """讀取檢查點的完成數量；檔案大小與修改時間沒變時直接沿用上次的結果"""
+    with _summaries_lock:
+        cached = _summaries.get(checkpoint.path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    try:
+        header, completed = checkpoint.load()
+    except (OSError, ValueError):
+        summary = None
+    else:
+        summary = {'run_id': checkpoint.run_id, 'total': len(header['urls']), 'done': len(completed),
+                   'complete': header['complete']}
+    with _summaries_lock:
+        _summaries[checkpoint.path] = (signature, summary)
+    return summary
+
+
+def list_runs(directory=DEFAULT_CHECKPOINT_DIR):
+    """列出目錄中的檢查點，依最後更新時間由新到舊排序，回傳 dict 清單
+
+    只有新增或變動過的檔案會重新解析，其餘沿用快取的摘要。complete 為 False 表示串流來源未讀完，
+    即使 done 等於 total 仍需續跑。
+    """
+    if not os.path.isdir(directory):
+        return []
+    runs = []
+    for name in os.listdir(directory):
+        run_id = name[:-len('.jsonl')]
+        # 略過不是由 RunCheckpoint 建立的檔案（例如手動複製的 run-1.jsonl）
+        if not name.endswith('.jsonl') or not run_id.isalnum():
+            continue
+        checkpoint = RunCheckpoint(run_id, directory)
+        try:
+            stat = os.stat(checkpoint.path)
+        except OSError:
+            continue
+        summary = _summarize(checkpoint, (stat.st_mtime_ns, stat.st_size))
+        if summary is not None:
+            runs.append({**summary, 'updated_at': stat.st_mtime})
+    runs.sort(key=lambda run: run['updated_at'], reverse=True)
+    return runs
+
+
+def prune_runs(directory=DEFAULT_CHECKPOINT_DIR, retention_days=DEFAULT_RETENTION_DAYS):
+    """刪除超過 retention_days 天未更新的檢查點與其保存的來源檔案，回傳刪除的檢查點數量"""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+    removed = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if not name.endswith('.jsonl') or os.path.getmtime(path) >= cutoff:
+                continue
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+        with _summaries_lock:
+            _summaries.pop(path, None)
+    # 來源檔案跟著所屬的檢查點刪除
+    for name in os.listdir(directory):
+        if name.endswith('.source') and not os.path.exists(os.path.join(directory, f"{name.split('-')[0]}.jsonl")):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""背景批次任務：在腳本執行緒之外執行查詢，rerun 或換頁後仍可重新連結"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+from pagespeed_batch import run_batch
+from results_buffer import ResultBuffer
+from session_store import SessionFrameStore
+
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+DEFAULT_MAX_FINISHED = 50
+# 串流來源預先讀取、等待查詢的項目上限；佇列滿時讀取端暫停
+DEFAULT_READ_AHEAD = 1000
+
+_END = object()
+
+
+class Job:
+    """單一批次任務的狀態與結果，可由任何執行緒安全讀取"""
+
+    def __init__(self, job_id, total, initial_results=(), monitors=None, cancel=None):
+        self.id = job_id
+        self.total = total
+        # 網址來源是串流（例如 sitemap）時，讀取完畢前 total 只是目前已找到的數量
+        self.total_known = True
+        # 供介面顯示的執行期物件，例如並行控制器或 API Key 池
+        self.monitors = dict(monitors or {})
+        self.status = RUNNING
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        # 可由呼叫端提供，讓 fetch 內的等待（例如等待 API Key）也能在停止時中斷
+        self._cancel = cancel or threading.Event()
+        # 沿用的結果（快取或檢查點）與本次查詢的結果分開存放
+        self._carried = ResultBuffer()
+        self._carried.extend(initial_results)
+        self._results = ResultBuffer()
+        # 結束後結果表移到共用的 SessionFrameStore，由其依記憶體預算與閒置時間寫到磁碟或刪除
+        self._store = None
+        self._errors = []
+        self.skipped = len(self._carried)
+        self.fetched = 0
+
+    @property
+    def done(self):
+        return self.skipped + self.fetched
+
+    @property
+    def finished(self):
+        return self.status != RUNNING
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def throughput(self):
+        """本次任務每分鐘完成的網址數"""
+        end = self.finished_at or time.monotonic()
+        return self.fetched / max(end - self.started_at, 1.0) * 60
+
+    def cancel(self):
+        """要求停止任務，進行中的請求完成後即結束"""
+        self._cancel.set()
+
+    def discover(self):
+        with self._lock:
+            self.total += 1
+
+    def carry(self, result):
+        """加入一筆沿用的結果，不計入本次查詢"""
+        with self._lock:
+            # 停止後讀取端可能還在處理最後一個項目，結束後的結果直接捨棄
+            if self._store is None and not self._carried.frozen:
+                self._carried.append(result)
+                self.skipped += 1
+
+    def record(self, item, result, error):
+        with self._lock:
+            self.fetched += 1
+            if error is None:
+                self._results.append(result)
+            else:
+                self._errors.append((item, str(error)))
+
+    def finish(self, status, error=None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished_at = time.monotonic()
+            # 結束後結果不再增加，轉成緊湊的欄式型別，釋放逐列累積的 Python 物件
+            self._carried.freeze()
+            self._results.freeze()
+
+    def park(self, store):
+        """結束後把結果表交給 store 保存，任務本身不再持有；閒置過久被刪除後結果表為空"""
+        with self._lock:
+            carried, results = self._carried.freeze(), self._results.freeze()
+        store.put(self.id, 'carried', carried)
+        store.put(self.id, 'fetched', results)
+        with self._lock:
+            self._store = store
+            self._carried = self._results = None
+
+    def _frames(self):
+        """回傳 (沿用的結果, 本次查詢的結果)"""
+        with self._lock:
+            store = self._store
+            if store is None:
+                return self._carried.to_frame(), self._results.to_frame()
+        return tuple(store.get(self.id, name) for name in ('carried', 'fetched'))
+
+    def results_frame(self):
+        carried, results = self._frames()
+        frames = [frame for frame in (carried, results) if frame is not None and len(frame)]
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def fetched_frame(self):
+        """只包含本次實際查詢的結果，不含沿用的快取或檢查點結果"""
+        results = self._frames()[1]
+        return results if results is not None else pd.DataFrame()
+
+    def errors(self):
+        with self._lock:
+            return list(self._errors)
+
+
+class JobManager:
+    """整個程序共用的任務登記表；已結束的任務保留最近 max_finished 個
+
+    已結束任務的結果表存放在 store（SessionFrameStore，以任務 ID 為 session），
+    受其記憶體預算限制，閒置後寫到磁碟，閒置過久則刪除。
+    """
+
+    def __init__(self, max_finished=DEFAULT_MAX_FINISHED, store=None):
+        self.max_finished = max_finished
+        self.store = store if store is not None else SessionFrameStore()
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def submit(self, items, fetch, max_workers=4, rate_limiter=None, deadline=None, on_result=None,
+               initial_results=(), job_id=None, monitors=None, on_finish=None, lookup=None, cancel=None):
+        """建立任務並在背景執行緒開始執行，立即回傳 Job
+
+        on_result(item, result) 會在每筆成功結果寫入任務前於背景執行緒呼叫。
+        指定 job_id 時可沿用先前已結束任務的 ID（例如從檢查點續跑）。
+        monitors 只用於顯示（例如並行控制器、API Key 池），實際的控制需由 fetch 自行包裝。
+        on_finish(job) 會在任務標記為結束（含停止與失敗）前於背景執行緒呼叫一次。
+        items 不是 list/tuple 時（例如 sitemap 產生器）會在另一個執行緒邊讀取邊送進查詢佇列，
+        不必等全部讀完；lookup(item) 回傳結果時直接沿用，不再查詢。
+        cancel 為 threading.Event 時，Job.cancel() 會設定它，fetch 可藉此中斷自己的等待。
+        """
+        streaming = not isinstance(items, (list, tuple))
+        initial_results = list(initial_results)
+        total = len(initial_results) + (0 if streaming else len(items))
+        job = Job(job_id or uuid.uuid4().hex[:12], total, initial_results, monitors=monitors, cancel=cancel)
+        if streaming or lookup is not None:
+            job.total_known = not streaming
+            items = self._read_ahead(job, items, lookup)
+        with self._lock:
+            existing = self._jobs.get(job.id)
+            if existing is not None and not existing.finished:
+                raise ValueError(f"任務 {job.id} 仍在執行中")
+            if self._jobs.pop(job.id, None) is not None:
+                self._discard(job.id)
+            self._jobs[job.id] = job
+            self._evict()
+        thread = threading.Thread(
+            target=self._run,
+            args=(job, items, fetch, max_workers, rate_limiter, deadline, on_result, on_finish),
+            name=f"pagespeed-job-{job.id}",
+            daemon=True
+        )
+        thread.start()
+        return job
+
+    def _run(self, job, items, fetch, max_workers, rate_limiter, deadline, on_result, on_finish):
+        try:
+            batch = run_batch(items, fetch, max_workers=max_workers, rate_limiter=rate_limiter, deadline=deadline)
+            try:
+                for item, result, error in batch:
+                    if error is None and on_result is not None:
+                        on_result(item, result)
+                    job.record(item, result, error)
+                    if job.cancel_requested:
+                        break
+            finally:
+                batch.close()
+            status, error = (CANCELLED if job.cancel_requested else DONE), None
+        except Exception as e:
+            status, error = FAILED, e
+        if on_finish is not None:
+            try:
+                on_finish(job)
+            except Exception as e:
+                status, error = FAILED, error or e
+        job.finish(status, error)
+        try:
+            job.park(self.store)
+        except Exception:
+            # 無法移到 store 時結果表仍留在任務中
+            pass
+
+    def _read_ahead(self, job, items, lookup, max_pending=DEFAULT_READ_AHEAD):
+        """在背景執行緒讀取 items 並放入有上限的佇列，查詢端從佇列逐一取出
+
+        佇列滿時讀取端等待；任務停止或查詢端不再取用時，讀取端不會一直卡在佇列上。
+        """
+        pending = queue.Queue(maxsize=max_pending)
+        errors = []
+        closed = threading.Event()
+
+        def put(item, stop):
+            while not stop():
+                try:
+                    pending.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def reader():
+            try:
+                for item in items:
+                    if job.cancel_requested:
+                        break
+                    if not job.total_known:
+                        job.discover()
+                    result = lookup(item) if lookup is not None else None
+                    if result is not None:
+                        job.carry(result)
+                    elif not put(item, lambda: job.cancel_requested or closed.is_set()):
+                        break
+            except Exception as e:
+                errors.append(e)
+            job.total_known = True
+            # 停止後查詢端可能仍在等待下一個項目，結束標記一定要送達（除非查詢端已不再取用）
+            put(_END, closed.is_set)
+
+        threading.Thread(target=reader, name=f"pagespeed-reader-{job.id}", daemon=True).start()
+        try:
+            while True:
+                item = pending.get()
+                if item is _END:
+                    if errors:
+                        raise errors[0]
+                    return
+                yield item
+        finally:
+            closed.set()
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+            self._discard(job_id)
+
+    def _discard(self, job_id):
+        for name in ('carried', 'fetched'):
+            self.store.discard(job_id, name)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""多組 API Key 的輪替池：各自限速、統計用量，配額用盡的 Key 自動暫停"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+from pagespeed_batch import DeadlineExceeded, TokenBucket
+from perf_metrics import METRICS
+
+DEFAULT_DAILY_QUOTA = 25000
+DEFAULT_COOLDOWN = 60
+# 所有 Key 都暫停時最多等待的秒數；要等更久（例如等到每日配額重置）時直接拋出 NoApiKeyAvailable
+DEFAULT_MAX_WAIT = 5 * 60
+# 等待時每次最多睡這麼久，期間可被停止或時限中斷
+WAIT_SLICE = 0.5
+
+
+class NoApiKeyAvailable(Exception):
+    """所有 API Key 都已停用、用完當日配額，或暫停到配額重置為止"""
+
+
+def parse_api_keys(*sources):
+    """合併多個來源（字串或清單，字串可用換行或逗號分隔）的 API Key，去除重複並保留順序"""
+    keys = []
+    for source in sources:
+        if not source:
+            continue
+        if isinstance(source, str):
+            source = source.replace(',', '\n').splitlines()
+        for key in source:
+            key = str(key).strip()
+            if key and key not in keys:
+                keys.append(key)
+    return keys
+
+
+def mask_key(key):
+    return f"…{key[-4:]}" if len(key) > 4 else "…"
+
+
+def _next_quota_reset():
+    """Google API 的每日配額在太平洋時間午夜重置；無時區資料時改為 24 小時後"""
+    try:
+        from zoneinfo import ZoneInfo
+        now = datetime.now(ZoneInfo('America/Los_Angeles'))
+        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return time.time() + (tomorrow - now).total_seconds()
+    except Exception:
+        return time.time() + 24 * 60 * 60
+
+
+def classify_key_error(error):
+    """判斷錯誤與 Key 的關係：'daily'（當日配額用盡）、'rate'（短時間配額）、'invalid'（Key 無效）或 None"""
+    response = getattr(error, 'response', None)
+    if not isinstance(error, requests.HTTPError) or response is None:
+        return None
+    text = response.text.lower() if response.text else ''
+    if response.status_code == 429:
+        return 'daily' if 'per day' in text or 'dailylimit' in text else 'rate'
+    if response.status_code in (400, 403) and ('api key' in text or 'api_key' in text):
+        return 'invalid'
+    if response.status_code == 403 and 'quota' in text:
+        return 'daily'
+    return None
+
+
+class ApiKeyState:
+    def __init__(self, key, rate_per_minute, daily_quota):
+        self.key = key
+        self.bucket = TokenBucket(rate_per_minute, per=60)
+        self.daily_quota = daily_quota
+        self.used = 0
+        self.resets_at = _next_quota_reset()
+        self.errors = 0
+        self.disabled_until = 0.0
+        self.invalid = False
+
+    def roll_over(self, now):
+        """過了配額重置時間就把當日用量歸零"""
+        if now >= self.resets_at:
+            self.used = 0
+            self.resets_at = _next_quota_reset()
+
+    @property
+    def remaining(self):
+        return max(0, self.daily_quota - self.used)
+
+    def available(self, now):
+        return not self.invalid and now >= self.disabled_until and self.remaining > 0
+
+
+class ApiKeyPool:
+    """將請求分散到多組 API Key
+
+    每次取用會挑選剩餘配額最多、且令牌桶有令牌的 Key；
+    回報短時間配額錯誤的 Key 暫停 cooldown 秒，當日配額用盡的 Key 暫停到配額重置為止。
+    同一組 Key 應共用同一個池（跨任務與 session），用量與暫停狀態才會正確；當日用量在配額重置時歸零。
+    所有 Key 都暫停時只等待不超過 max_wait 秒的短暫停，更久則拋出 NoApiKeyAvailable。
+    """
+
+    def __init__(self, keys, rate_per_minute=60, daily_quota=DEFAULT_DAILY_QUOTA, cooldown=DEFAULT_COOLDOWN,
+                 max_wait=DEFAULT_MAX_WAIT):
+        if not keys:
+            raise ValueError("至少需要一組 API Key")
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self._keys = [ApiKeyState(key, rate_per_minute, daily_quota) for key in keys]
+        self._lock = threading.Lock()
+
+    def configure(self, rate_per_minute=None, daily_quota=None):
+        """調整共用池的每分鐘上限與每日配額，已使用的數量保留"""
+        with self._lock:
+            for state in self._keys:
+                if rate_per_minute is not None:
+                    state.bucket.set_rate(rate_per_minute)
+                if daily_quota is not None:
+                    state.daily_quota = daily_quota
+
+    @METRICS.timed('api_key_wait_seconds')
+    def acquire(self, deadline=None, stop=None):
+        """取得一組可用的 Key（必要時等待令牌或短暫停），全部停用或暫停過久時拋出 NoApiKeyAvailable
+
+        deadline 為 time.monotonic() 時間，等待後會超過時拋出 DeadlineExceeded；
+        stop() 回傳 True 時（例如任務已停止）不再等待，拋出 NoApiKeyAvailable。
+        """
+        while True:
+            if stop is not None and stop():
+                raise NoApiKeyAvailable("任務已停止，不再等待 API Key")
+            with self._lock:
+                now = time.time()
+                for state in self._keys:
+                    state.roll_over(now)
+                candidates = sorted((state for state in self._keys if state.available(now)),
+                                    key=lambda state: state.remaining, reverse=True)
+                if not candidates:
+                    waiting = [state.disabled_until for state in self._keys
+                               if not state.invalid and state.remaining > 0]
+                    if not waiting:
+                        raise NoApiKeyAvailable("所有 API Key 都已無效或用完當日配額")
+                    wait_time = min(waiting) - now
+                    if wait_time > self.max_wait:
+                        raise NoApiKeyAvailable(f"所有 API Key 都已暫停，{wait_time / 60:.0f} 分鐘後才恢復（例如等待每日配額重置）")
+                else:
+                    wait_time = None
+                    for state in candidates:
+                        token_wait = state.bucket.try_acquire()
+                        if token_wait <= 0:
+                            state.used += 1
+                            return state.key
+                        wait_time = token_wait if wait_time is None else min(wait_time, token_wait)
+            if deadline is not None and time.monotonic() + wait_time > deadline:
+                raise DeadlineExceeded("超過整體時限，等待 API Key 時停止")
+            time.sleep(min(max(wait_time, 0.05), WAIT_SLICE))
+
+    def report(self, key, error):
+        """回報使用 key 的請求失敗，必要時將該 Key 移出輪替"""
+        kind = classify_key_error(error)
+        if kind is None:
+            return
+        with self._lock:
+            for state in self._keys:
+                if state.key != key:
+                    continue
+                state.errors += 1
+                if kind == 'invalid':
+                    state.invalid = True
+                elif kind == 'daily':
+                    state.disabled_until = _next_quota_reset()
+                else:
+                    state.disabled_until = time.time() + self.cooldown
+
+    def wrap(self, fn, deadline=None, stop=None):
+        """包裝 fn(url, api_key) 成 fn(url)，自動挑選 Key 並回報錯誤；deadline 與 stop 傳給 acquire"""
+        def wrapper(url, *args, **kwargs):
+            key = self.acquire(deadline=deadline, stop=stop)
+            try:
+                return fn(url, key, *args, **kwargs)
+            except Exception as e:
+                self.report(key, e)
+                raise
+        return wrapper
+
+    def status(self):
+        """各 Key 的用量摘要，Key 只顯示末四碼"""
+        now = time.time()
+        with self._lock:
+            return [{
+                'API Key': mask_key(state.key),
+                '狀態': '無效' if state.invalid else ('使用中' if state.available(now) else '暫停'),
+                '已使用': state.used,
+                '剩餘配額': state.remaining,
+                '錯誤次數': state.errors,
+            } for state in self._keys]
+
+    def __len__(self):
+        return len(self._keys)
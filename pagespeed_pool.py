@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""跨 session 共用的查詢池：合併相同網址的請求並保留近期結果"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_RETENTION = 10 * 60
+DEFAULT_MAX_COMPLETED = 10000
+
+
+class SharedResultPool:
+    """整個程序共用的查詢登記表
+
+    同一個 key 同時只會有一個請求在進行，其他呼叫端等待同一個結果；
+    完成的結果會在記憶體中保留 `retention` 秒，期間內的查詢直接回傳。
+    """
+
+    def __init__(self, retention=DEFAULT_RETENTION, max_completed=DEFAULT_MAX_COMPLETED):
+        self.retention = retention
+        self.max_completed = max_completed
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._completed = OrderedDict()
+
+    def fetch(self, key, call, refresh=False):
+        """取得 key 的結果；若尚未有人查詢則執行 call()，否則等待或直接沿用
+
+        refresh 為 True 時（例如強制重新查詢）不沿用已完成的結果，但仍與進行中的相同請求合併。
+        """
+        with self._lock:
+            entry = None if refresh else self._completed.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] <= self.retention:
+                    self._completed.move_to_end(key)
+                    return entry[1]
+                del self._completed[key]
+
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = call()
+        except BaseException as e:
+            # 失敗的結果不保留，讓下一次查詢重新嘗試
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._completed[key] = (time.monotonic(), result)
+            while len(self._completed) > self.max_completed:
+                self._completed.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def in_flight_count(self):
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""效能量測：熱點路徑的耗時直方圖，可輸出 Prometheus 文字格式或 JSON，並提供單次 cProfile 剖析
+
+    from perf_metrics import METRICS
+    with METRICS.timer('pagespeed_parse_seconds'):
+        ...
+"""
+
+import bisect
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 直方圖的上界（秒），涵蓋毫秒級的解析到數十秒的 API 請求
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    'pagespeed_request_seconds': 'PageSpeed API 單次請求耗時（含網路與伺服器處理）',
+    'pagespeed_parse_seconds': 'PageSpeed 回應解析耗時',
+    'rate_limit_wait_seconds': '批次項目等待限速令牌的時間',
+    'api_key_wait_seconds': '等待可用 API Key（令牌或暫停結束）的時間',
+    'concurrency_wait_seconds': '等待自動調整的並行上限空出名額的時間',
+    'streamlit_rerun_seconds': 'Streamlit 整頁重新執行耗時',
+    'job_view_render_seconds': '背景任務檢視（每 2 秒更新）的繪製耗時',
+    'workbook_ingest_seconds': '活頁簿解析耗時（未命中快取時）',
+    'tag_count_seconds': '標籤計數耗時（每批）',
+    'page_check_seconds': '增量查詢時檢查頁面是否變更的耗時（條件式請求）',
+}
+
+
+class Histogram:
+    """固定桶界的累積直方圖，與 Prometheus histogram 相同的語意"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """以桶界估計分位數（取落點所在桶的上界），沒有資料時回傳 None"""
+        with self._lock:
+            if not self.count:
+                return None
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets + (self.max,), self._counts):
+                seen += count
+                if seen >= target:
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = []
+            seen = 0
+            for bound, count in zip(self.buckets, self._counts):
+                seen += count
+                cumulative.append((bound, seen))
+            return {'count': self.count, 'sum': self.sum, 'max': self.max, 'buckets': cumulative}
+
+
+class MetricsRegistry:
+    """以名稱登記的直方圖集合，可在多個執行緒間共用"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def snapshot(self, name):
+        """取得單一指標的快照，尚無資料時回傳 None"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+        return histogram.snapshot() if histogram is not None else None
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name):
+        """函式裝飾器版本的 timer"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def summary(self):
+        """每個指標的次數、平均、p50、p95 與最大值（秒），依名稱排序"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+        return [{
+            'metric': name,
+            'count': histogram.count,
+            'mean': histogram.sum / histogram.count if histogram.count else None,
+            'p50': histogram.quantile(0.5),
+            'p95': histogram.quantile(0.95),
+            'max': histogram.max,
+        } for name, histogram in items]
+
+    def to_json(self):
+        with self._lock:
+            items = sorted(self._histograms.items())
+        return json.dumps({name: histogram.snapshot() for name, histogram in items}, ensure_ascii=False)
+
+    def to_prometheus(self):
+        """輸出 Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+        for name, histogram in items:
+            snapshot = histogram.snapshot()
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for bound, count in snapshot['buckets']:
+                lines.append(f'{name}_bucket{{le="{bound:g}"}} {count}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+            lines.append(f"{name}_sum {snapshot['sum']:.6f}")
+            lines.append(f"{name}_count {snapshot['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """寫入檔案：副檔名為 .json 時輸出 JSON，否則輸出 Prometheus 文字格式"""
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+# 整個程序共用的量測登記表
+METRICS = MetricsRegistry()
+
+
+def start_metrics_server(port, registry=METRICS, host='127.0.0.1'):
+    """在背景執行緒提供 /metrics（Prometheus）與 /metrics.json，回傳伺服器物件"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith('/metrics.json'):
+                body, content_type = registry.to_json(), 'application/json'
+            elif self.path.startswith('/metrics'):
+                body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', f"{content_type}; charset=utf-8")
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def profile_report(profiler, limit=40, sort='cumulative'):
+    """將 cProfile 結果整理成文字報告"""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+@contextmanager
+def profiled(enabled=True):
+    """在區塊內啟用 cProfile；結束後 report['text'] 為剖析報告"""
+    report = {'text': None}
+    if not enabled:
+        yield report
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        report['text'] = profile_report(profiler)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""完整 Lighthouse 報告的壓縮封存：依內容雜湊去除重複，並以網址/策略/語系/類別/時間建立索引
+
+之後需要新的指標時，可直接從封存重新擷取，不必再呼叫 API：
+
+    python report_archive.py unused-javascript details.overallSavingsBytes -o unused_js.csv
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pagespeed_api import DEFAULT_CATEGORIES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_ARCHIVE_DIR = os.environ.get('PAGESPEED_ARCHIVE_DIR', 'pagespeed_archive')
+
+
+def categories_key(categories):
+    return ','.join(sorted(categories))
+
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if codec == 'lzma':
+        return lzma.compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    raise ValueError(f"不支援的壓縮格式：{codec}")
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("讀取 zstd 封存需要安裝 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lzma':
+        return lzma.decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    raise ValueError(f"不支援的壓縮格式：{codec}")
+
+
+class ReportArchive:
+    """以 SHA-256 內容雜湊存放壓縮後的原始回應，相同內容只存一份"""
+
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIR, codec=None):
+        self.directory = directory
+        self.codec = codec or default_codec()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS reports ('
+                ' url TEXT NOT NULL,'
+                ' strategy TEXT NOT NULL,'
+                ' fetched_at REAL NOT NULL,'
+                ' digest TEXT NOT NULL,'
+                ' codec TEXT NOT NULL)'
+            )
+            # 查詢矩陣的各組合分開記錄；舊的封存只有預設類別、未指定語系的報告
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(reports)')}
+            if 'locale' not in columns:
+                self._conn.execute("ALTER TABLE reports ADD COLUMN locale TEXT NOT NULL DEFAULT ''")
+            if 'categories' not in columns:
+                self._conn.execute('ALTER TABLE reports ADD COLUMN categories TEXT NOT NULL'
+                                   f" DEFAULT '{categories_key(DEFAULT_CATEGORIES)}'")
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_reports_variant'
+                ' ON reports (url, strategy, locale, categories, fetched_at)'
+            )
+
+    def object_path(self, digest, codec):
+        return os.path.join(self.directory, 'objects', digest[:2], f"{digest[2:]}.json.{codec}")
+
+    def put(self, url, strategy, content, categories=DEFAULT_CATEGORIES, locale=None):
+        """封存一份原始回應（bytes），回傳內容雜湊"""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest, self.codec)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先寫入暫存檔再改名，避免中斷時留下不完整的檔案
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(compress(content, self.codec))
+            os.replace(tmp_path, path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO reports (url, strategy, locale, categories, fetched_at, digest, codec)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, strategy, locale or '', categories_key(categories), time.time(), digest, self.codec)
+            )
+        return digest
+
+    def get(self, digest, codec=None):
+        """讀取並解壓縮一份封存的回應"""
+        codec = codec or self.codec
+        with open(self.object_path(digest, codec), 'rb') as f:
+            return decompress(f.read(), codec)
+
+    def reports(self, latest_only=True, strategy=None):
+        """列出封存的報告，回傳 (url, strategy, locale, categories, fetched_at, digest, codec) 清單
+
+        latest_only 時每個組合（網址、策略、語系、類別）只取最新一份，
+        只查詢部分類別或其他語系的報告不會取代完整報告。
+        """
+        query = 'SELECT url, strategy, locale, categories, MAX(fetched_at), digest, codec FROM reports'
+        if not latest_only:
+            query = 'SELECT url, strategy, locale, categories, fetched_at, digest, codec FROM reports'
+        params = ()
+        if strategy:
+            query += ' WHERE strategy = ?'
+            params = (strategy,)
+        if latest_only:
+            query += ' GROUP BY url, strategy, locale, categories'
+        with self._lock:
+            return self._conn.execute(query + ' ORDER BY url', params).fetchall()
+
+    def reextract(self, extractor, latest_only=True, strategy=None, processes=None):
+        """以多個行程平行地對封存報告執行 extractor(report_dict)，回傳結果 dict 清單
+
+        extractor 必須可被 pickle（模組層級函式或 AuditExtractor）。
+        """
+        rows = self.reports(latest_only=latest_only, strategy=strategy)
+        tasks = [(self.object_path(digest, codec), codec,
+                  {'url': url, 'strategy': strategy, 'locale': locale or None, 'categories': categories,
+                   'fetched_at': fetched_at}, extractor)
+                 for url, strategy, locale, categories, fetched_at, digest, codec in rows]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(_extract_one, tasks, chunksize=max(1, len(tasks) // 64)))
+
+
+def _extract_one(task):
+    path, codec, row, extractor = task
+    with open(path, 'rb') as f:
+        report = json.loads(decompress(f.read(), codec))
+    return {**row, **extractor(report)}
+
+
+class AuditExtractor:
+    """從 lighthouseResult.audits[audit_id] 依點分隔的路徑取值，例如 details.overallSavingsBytes"""
+
+    def __init__(self, audit_id, field='numericValue', name=None):
+        self.audit_id = audit_id
+        self.field = field
+        self.name = name or f"{audit_id}.{field}"
+
+    def __call__(self, report):
+        node = report.get('lighthouseResult', {}).get('audits', {}).get(self.audit_id)
+        for key in self.field.split('.'):
+            node = node.get(key) if isinstance(node, dict) else None
+        return {self.name: node}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="從封存的 Lighthouse 報告重新擷取指標（不呼叫 API）")
+    parser.add_argument('audit_id', help="稽核項目 ID，例如 unused-javascript")
+    parser.add_argument('field', nargs='?', default='numericValue', help="稽核內的欄位路徑，預設 numericValue")
+    parser.add_argument('--archive', default=DEFAULT_ARCHIVE_DIR)
+    parser.add_argument('--strategy', help="只處理指定策略（mobile / desktop）")
+    parser.add_argument('--all', action='store_true', help="處理每一份報告，而不只是每個網址最新的一份")
+    parser.add_argument('--processes', type=int, help="平行行程數，預設為 CPU 核心數")
+    parser.add_argument('-o', '--output', help="輸出 CSV 檔案，預設輸出到標準輸出")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    archive = ReportArchive(args.archive)
+    rows = archive.reextract(AuditExtractor(args.audit_id, args.field), latest_only=not args.all,
+                             strategy=args.strategy, processes=args.processes)
+    pd.DataFrame(rows).to_csv(args.output or sys.stdout, index=False)
+
+
+if __name__ == '__main__':
+    main()
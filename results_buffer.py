@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""逐筆累積查詢結果的欄式緩衝區、緊湊的欄式型別轉換，以及節流的畫面更新"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+# 不重複值佔列數的比例低於此值的文字欄位轉為 category（例如策略、語系、組合）
+CATEGORY_RATIO = 0.5
+
+
+def compact_frame(frame):
+    """轉成較省記憶體的欄式型別，回傳新的 DataFrame
+
+    浮點數欄位在 float32 能精確表示時（例如 0~100 的分數）改為 float32；
+    重複度高的文字欄位改為 category，每個不同的值只存一份；
+    其餘仍是 Python 物件的文字欄位（例如網址）改為 pandas 的字串型別（安裝 pyarrow 時為 Arrow 字串，
+    整欄存放在連續的緩衝區，而不是逐列的 Python 物件）。
+    """
+    columns = {}
+    for name, values in frame.items():
+        if pd.api.types.is_float_dtype(values) and values.dtype != np.float32:
+            narrowed = values.astype('float32')
+            if (narrowed.astype('float64') == values)[values.notna()].all():
+                values = narrowed
+        elif pd.api.types.is_integer_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            values = pd.to_numeric(values, downcast='integer')
+        elif values.dtype == object or pd.api.types.is_string_dtype(values):
+            inferred = pd.api.types.infer_dtype(values, skipna=True)
+            if inferred == 'empty':
+                # 整欄都是空值（例如類別組合不含的分數）時以 float32 的 NaN 存放，與數值欄合併時型別一致
+                values = values.astype('float32')
+            elif inferred == 'string' and values.nunique() < CATEGORY_RATIO * len(values):
+                values = values.astype('category')
+            elif inferred == 'string' and values.dtype == object:
+                values = values.astype('str')
+        columns[name] = values
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def frame_nbytes(frame):
+    """DataFrame 實際佔用的記憶體（含文字內容）"""
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class ResultBuffer:
+    """以欄為單位的 append-only 緩衝區，新增一列只需 O(1)"""
+
+    def __init__(self, columns=None):
+        self._columns = {name: [] for name in (columns or [])}
+        self._length = 0
+        self._frame = None
+
+    @property
+    def frozen(self):
+        return self._frame is not None
+
+    def append(self, row):
+        """新增一列；遇到新欄位時以 None 補齊先前的列"""
+        if self.frozen:
+            raise RuntimeError("緩衝區已凍結，不能再新增資料")
+        for name in row:
+            if name not in self._columns:
+                self._columns[name] = [None] * self._length
+        for name, values in self._columns.items():
+            values.append(row.get(name))
+        self._length += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return self._length
+
+    def to_frame(self):
+        if self.frozen:
+            return self._frame
+        return pd.DataFrame(self._columns)
+
+    def freeze(self):
+        """不再新增資料時呼叫：轉成 compact_frame 並釋放逐欄累積的清單，之後 to_frame 直接回傳該 DataFrame"""
+        if not self.frozen:
+            self._frame = compact_frame(self.to_frame())
+            self._columns = {}
+        return self._frame
+
+
+class RefreshThrottle:
+    """控制畫面更新頻率：距上次更新超過 interval 秒，或累積 every_rows 筆新資料時才更新"""
+
+    def __init__(self, interval=2.0, every_rows=None):
+        self.interval = interval
+        self.every_rows = every_rows
+        self._last_time = None
+        self._last_rows = 0
+
+    def due(self, rows):
+        """判斷目前筆數下是否該更新畫面，若是則記錄這次更新"""
+        now = time.monotonic()
+        if (self._last_time is None
+                or now - self._last_time >= self.interval
+                or (self.every_rows and rows - self._last_rows >= self.every_rows)):
+            self._last_time = now
+            self._last_rows = rows
+            return True
+        return False
+
+
+def format_eta(started_at, done, total):
+    """依已完成數量估算剩餘時間，回傳像是「預估剩餘 3 分 20 秒」的文字"""
+    if done <= 0 or done >= total:
+        return ""
+    remaining = (time.monotonic() - started_at) / done * (total - done)
+    minutes, seconds = divmod(int(remaining), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"預估剩餘 {hours} 小時 {minutes} 分"
+    if minutes:
+        return f"預估剩餘 {minutes} 分 {seconds} 秒"
+    return f"預估剩餘 {seconds} 秒"
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""分批將結果寫成 CSV / Excel / Parquet
+
+export_frame 寫入暫存檔（SpooledTemporaryFile），命令列工具可直接複製到輸出檔，不在記憶體中保留整份檔案；
+Streamlit 的下載按鈕只接受完整的位元組，介面改用 export_bytes。
+"""
+
+import io
+import tempfile
+
+# 格式代碼: (顯示名稱, 副檔名, MIME)
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'csv', 'text/csv'),
+    'xlsx': ('Excel', 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': ('Parquet', 'parquet', 'application/vnd.apache.parquet'),
+}
+DEFAULT_CHUNK_ROWS = 50000
+# 超過此大小時暫存檔會自動改存到磁碟
+DEFAULT_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def iter_chunks(frame, chunk_rows=DEFAULT_CHUNK_ROWS):
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows]
+
+
+def _write_csv(frame, out, chunk_rows):
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    header = True
+    for chunk in iter_chunks(frame, chunk_rows):
+        chunk.to_csv(text, index=False, header=header)
+        header = False
+    if header:
+        frame.head(0).to_csv(text, index=False)
+    text.flush()
+    # 與底層檔案分離，避免 TextIOWrapper 被回收時關閉暫存檔
+    text.detach()
+
+
+def _write_xlsx(frame, out, chunk_rows):
+    from openpyxl import Workbook
+
+    # write-only 模式逐列寫出，不在記憶體中保留整張工作表
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([str(column) for column in frame.columns])
+    for chunk in iter_chunks(frame, chunk_rows):
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(out)
+
+
+def _write_parquet(frame, out, chunk_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in iter_chunks(frame, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+_WRITERS = {
+    'csv': _write_csv,
+    'xlsx': _write_xlsx,
+    'parquet': _write_parquet,
+}
+
+
+def export_frame(frame, fmt='csv', chunk_rows=DEFAULT_CHUNK_ROWS, spool_size=DEFAULT_SPOOL_SIZE):
+    """將 DataFrame 分批寫成指定格式，回傳已移到開頭的暫存檔"""
+    if fmt not in _WRITERS:
+        raise ValueError(f"不支援的匯出格式：{fmt}")
+    out = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    _WRITERS[fmt](frame, out, chunk_rows)
+    out.seek(0)
+    return out
+
+
+def export_bytes(frame, fmt='csv', chunk_rows=DEFAULT_CHUNK_ROWS):
+    """將 DataFrame 匯出成位元組，供 st.download_button 使用"""
+    with export_frame(frame, fmt, chunk_rows) as exported:
+        return exported.read()
+
+
+def export_file_name(base_name, fmt):
+    return f"{base_name}.{EXPORT_FORMATS[fmt][1]}"
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""PageSpeed 歷史分數的欄式儲存（依日期分區的 Parquet），支援快速的趨勢與退步查詢"""
+
+import os
+import uuid
+
+import pandas as pd
+
+from pagespeed_api import DEFAULT_STRATEGY, METRIC_FIELDS, SCORE_FIELDS
+
+DEFAULT_HISTORY_DIR = os.environ.get('PAGESPEED_HISTORY_DIR', 'pagespeed_history')
+KEY_COLUMNS = ['url', 'strategy', 'run_id', 'run_at']
+VALUE_COLUMNS = list(SCORE_FIELDS) + list(METRIC_FIELDS)
+
+
+class ScoreHistory:
+    """每次查詢寫成一個 Parquet 檔，放在 run_date=YYYY-MM-DD 分區目錄下
+
+    所有檔案使用固定的欄位結構，查詢時只讀取需要的欄位與日期分區，
+    比較運算全部以 pandas 向量化完成。
+    """
+
+    def __init__(self, directory=DEFAULT_HISTORY_DIR):
+        self.directory = directory
+
+    def append(self, results, run_id=None, strategy=DEFAULT_STRATEGY, run_at=None):
+        """寫入一次查詢的結果（DataFrame 或 dict 清單），回傳寫入的列數"""
+        frame = pd.DataFrame(results)
+        if frame.empty:
+            return 0
+        run_at = pd.Timestamp(run_at or pd.Timestamp.now(tz='UTC'))
+        if run_at.tzinfo is None:
+            run_at = run_at.tz_localize('UTC')
+
+        # 結果本身有 strategy 欄位時（例如多策略查詢）以該欄為準
+        strategies = frame['strategy'].astype(str) if 'strategy' in frame else strategy
+        frame = frame.reindex(columns=['url'] + VALUE_COLUMNS)
+        frame['url'] = frame['url'].astype(str)
+        frame[VALUE_COLUMNS] = frame[VALUE_COLUMNS].astype('float64')
+        frame['strategy'] = strategies
+        # 歷史分數不分語系與類別組合：同一個網址與策略的多筆結果（例如分開查詢 performance 與 seo）
+        # 合併成一筆，各欄取第一個非空值
+        frame = frame.groupby(['url', 'strategy'], sort=False, as_index=False).first()
+        frame['run_id'] = run_id or uuid.uuid4().hex[:12]
+        frame['run_at'] = run_at
+        frame = frame[KEY_COLUMNS + VALUE_COLUMNS]
+
+        partition = os.path.join(self.directory, f"run_date={run_at.strftime('%Y-%m-%d')}")
+        os.makedirs(partition, exist_ok=True)
+        path = os.path.join(partition, f"{frame['run_id'].iat[0]}-{uuid.uuid4().hex[:6]}.parquet")
+        frame.to_parquet(path, index=False)
+        return len(frame)
+
+    def load(self, columns=None, since=None, strategy=None):
+        """讀取歷史資料；since 為 Timestamp 時只讀取該日期之後的分區"""
+        if not os.path.isdir(self.directory):
+            return pd.DataFrame(columns=KEY_COLUMNS + VALUE_COLUMNS)
+        filters = []
+        if since is not None:
+            filters.append(('run_date', '>=', pd.Timestamp(since).strftime('%Y-%m-%d')))
+        if strategy is not None:
+            filters.append(('strategy', '==', strategy))
+        frame = pd.read_parquet(self.directory, columns=columns, filters=filters or None)
+        return frame.drop(columns=['run_date'], errors='ignore')
+
+    def latest(self, metric='performance', strategy=None, before=None):
+        """每個網址（與策略）在 before 之前最新一次的數值"""
+        frame = self.load(columns=['url', 'strategy', 'run_at', metric], strategy=strategy)
+        if before is not None:
+            frame = frame[frame['run_at'] <= pd.Timestamp(before)]
+        return _latest_per_url(frame)
+
+    def regressions(self, metric='performance', threshold=10, days=7, strategy=None, now=None):
+        """找出 metric 比 days 天前下降超過 threshold 的網址
+
+        以 days 天前（含）最後一次的數值為基準，與之後最新一次的數值比較，依下降幅度排序。
+        """
+        now = pd.Timestamp(now or pd.Timestamp.now(tz='UTC'))
+        if now.tzinfo is None:
+            now = now.tz_localize('UTC')
+        cutoff = now - pd.Timedelta(days=days)
+        frame = self.load(columns=['url', 'strategy', 'run_at', metric], strategy=strategy)
+        frame = frame.dropna(subset=[metric])
+
+        older = frame['run_at'] <= cutoff
+        baseline = _latest_per_url(frame[older])
+        current = _latest_per_url(frame[~older])
+        merged = baseline.merge(current, on=['url', 'strategy'], suffixes=('_before', '_now'))
+        merged['change'] = merged[f"{metric}_now"] - merged[f"{metric}_before"]
+        return merged[merged['change'] <= -threshold].sort_values('change').reset_index(drop=True)
+
+    def trend(self, url, strategy=None):
+        """單一網址的歷史數值，依時間排序"""
+        frame = self.load(strategy=strategy)
+        return frame[frame['url'] == url].sort_values('run_at').reset_index(drop=True)
+
+
+def _latest_per_url(frame):
+    frame = frame.sort_values('run_at', kind='stable')
+    return frame.drop_duplicates(['url', 'strategy'], keep='last').reset_index(drop=True)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""以 session 為單位保存大型結果表：轉成緊湊的欄式型別，超過每個 session 或全部合計的
+記憶體預算、或 session 閒置時寫到磁碟（Parquet），閒置過久則整個刪除，讓記憶體只隨使用中的 session 增加
+
+    store = SessionFrameStore()
+    store.put(session_key, 'results', frame)
+    frame = store.get(session_key, 'results')   # 已刪除時回傳 None
+"""
+
+import glob
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+from results_buffer import compact_frame, frame_nbytes
+
+DEFAULT_SPILL_DIR = os.environ.get('PAGESPEED_SPILL_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'pagespeed_sessions'))
+DEFAULT_SESSION_BUDGET = int(os.environ.get('PAGESPEED_SESSION_BUDGET_MB', 64)) * 1024 * 1024
+# 全部 session 合計的記憶體上限，超過時從最久未使用的 session 開始寫到磁碟
+DEFAULT_TOTAL_BUDGET = int(os.environ.get('PAGESPEED_STORE_BUDGET_MB', 512)) * 1024 * 1024
+# 閒置超過 idle_spill 秒的 session 寫到磁碟，超過 idle_evict 秒則刪除
+DEFAULT_IDLE_SPILL = 10 * 60
+DEFAULT_IDLE_EVICT = 24 * 60 * 60
+DEFAULT_SWEEP_INTERVAL = 60
+
+
+class _Entry:
+    __slots__ = ('frame', 'nbytes', 'path', 'spilling', 'removed')
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.nbytes = frame_nbytes(frame)
+        self.path = None
+        # 寫檔在鎖外進行：spilling 表示正在寫出（期間仍可從記憶體讀取），removed 表示已被取代或刪除
+        self.spilling = False
+        self.removed = False
+
+
+class _Session:
+    __slots__ = ('entries', 'last_access')
+
+    def __init__(self):
+        # 依最近使用順序排列，超過預算時先寫出最久未使用的項目
+        self.entries = OrderedDict()
+        self.last_access = time.time()
+
+    def memory(self):
+        """仍會留在記憶體的位元組數；正在寫出的項目不計入"""
+        return sum(entry.nbytes for entry in self.entries.values()
+                   if entry.frame is not None and not entry.spilling)
+
+
+class SessionFrameStore:
+    """整個程序共用的 session 結果表儲存
+
+    session_key 由呼叫端決定（例如存在 st.session_state 的隨機 ID）。Streamlit 不會通知
+    session 結束，因此以最後存取時間判斷閒置；每次存取時最多每 sweep_interval 秒整理一次。
+    Parquet 的讀寫都在鎖外進行，一個 session 寫出或載入大型結果表時不會擋住其他 session。
+    """
+
+    def __init__(self, directory=DEFAULT_SPILL_DIR, session_budget=DEFAULT_SESSION_BUDGET,
+                 idle_spill=DEFAULT_IDLE_SPILL, idle_evict=DEFAULT_IDLE_EVICT,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL, total_budget=DEFAULT_TOTAL_BUDGET):
+        self.directory = directory
+        self.session_budget = session_budget
+        self.total_budget = total_budget
+        self.idle_spill = idle_spill
+        self.idle_evict = idle_evict
+        self.sweep_interval = sweep_interval
+        self.counts = {'spilled': 0, 'loaded': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._last_sweep = time.time()
+
+    def put(self, session_key, name, frame):
+        """保存結果表（轉成 compact_frame），回傳保存的 DataFrame"""
+        frame = compact_frame(pd.DataFrame(frame))
+        with self._lock:
+            session = self._touch(session_key)
+            old = session.entries.pop(name, None)
+            if old is not None:
+                self._remove(old)
+            session.entries[name] = _Entry(frame)
+            pending = self._over_budget(session, keep=name) + self._over_total()
+        self._write(pending)
+        self.maybe_sweep()
+        return frame
+
+    def get(self, session_key, name):
+        """取回結果表；已寫到磁碟時重新載入，已刪除或不存在時回傳 None"""
+        with self._lock:
+            session = self._touch(session_key)
+            entry = session.entries.get(name)
+            if entry is None:
+                return None
+            session.entries.move_to_end(name)
+            frame, path = entry.frame, entry.path
+        pending = []
+        if frame is None:
+            try:
+                frame = pd.read_parquet(path)
+            except OSError:
+                # 讀取期間項目被取代或刪除
+                return None
+            with self._lock:
+                self.counts['loaded'] += 1
+                # 單一結果表就超過預算時只讀出使用，不保留在記憶體
+                if not entry.removed and entry.frame is None and entry.nbytes <= self.session_budget:
+                    entry.frame = frame
+                    pending = self._over_budget(session, keep=name) + self._over_total()
+        self._write(pending)
+        self.maybe_sweep()
+        return frame
+
+    def discard(self, session_key, name):
+        with self._lock:
+            session = self._sessions.get(session_key)
+            entry = session.entries.pop(name, None) if session is not None else None
+            if entry is not None:
+                self._remove(entry)
+
+    def touch(self, session_key):
+        """標記 session 仍在使用（例如每次 rerun），並視需要整理閒置的 session"""
+        with self._lock:
+            if session_key in self._sessions:
+                self._touch(session_key)
+        self.maybe_sweep()
+
+    def maybe_sweep(self):
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def sweep(self, now=None):
+        """閒置的 session 寫到磁碟，閒置過久的 session 刪除；一併清除先前程序遺留的檔案"""
+        now = now or time.time()
+        pending = []
+        with self._lock:
+            self._last_sweep = now
+            for session_key, session in list(self._sessions.items()):
+                idle = now - session.last_access
+                if idle >= self.idle_evict:
+                    for entry in session.entries.values():
+                        self._remove(entry)
+                    self.counts['evicted'] += len(session.entries)
+                    del self._sessions[session_key]
+                elif idle >= self.idle_spill:
+                    pending.extend(self._mark_spill(entry) for entry in session.entries.values())
+            known = {entry.path for session in self._sessions.values() for entry in session.entries.values()}
+        self._write([item for item in pending if item is not None])
+        for path in glob.glob(os.path.join(self.directory, '*.parquet')):
+            try:
+                if path not in known and now - os.path.getmtime(path) >= self.idle_evict:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def usage(self):
+        """回傳 session 數量、記憶體中與已寫到磁碟的位元組數"""
+        with self._lock:
+            entries = [entry for session in self._sessions.values() for entry in session.entries.values()]
+            return {
+                'sessions': len(self._sessions),
+                'frames': len(entries),
+                'memory_bytes': sum(entry.nbytes for entry in entries if entry.frame is not None),
+                'spilled_bytes': sum(entry.nbytes for entry in entries if entry.frame is None),
+                **self.counts,
+            }
+
+    def _touch(self, session_key):
+        session = self._sessions.get(session_key)
+        if session is None:
+            session = self._sessions[session_key] = _Session()
+        session.last_access = time.time()
+        return session
+
+    def _over_budget(self, session, keep):
+        """記憶體超過預算時，從最久未使用的項目開始標記寫出；keep 為剛存取的項目，最後才寫出。
+        須持有鎖；回傳的項目交給 _write 在鎖外寫到磁碟"""
+        pending = []
+        names = [name for name in session.entries if name != keep] + [keep]
+        for name in names:
+            if session.memory() <= self.session_budget:
+                break
+            item = self._mark_spill(session.entries[name])
+            if item is not None:
+                pending.append(item)
+        return pending
+
+    def _over_total(self):
+        """全部 session 合計超過 total_budget 時，從最久未使用的 session 開始標記寫出；須持有鎖"""
+        pending = []
+        memory = sum(session.memory() for session in self._sessions.values())
+        for session in sorted(self._sessions.values(), key=lambda session: session.last_access):
+            for entry in session.entries.values():
+                if memory <= self.total_budget:
+                    return pending
+                in_memory = entry.frame is not None and not entry.spilling
+                item = self._mark_spill(entry)
+                if in_memory:
+                    memory -= entry.nbytes
+                if item is not None:
+                    pending.append(item)
+        return pending
+
+    def _mark_spill(self, entry):
+        """須持有鎖；回傳 (項目, 結果表, 檔案路徑)，已在磁碟上的項目直接釋放記憶體並回傳 None"""
+        if entry.frame is None or entry.spilling:
+            return None
+        if entry.path is not None:
+            # 先前寫出後重新載入的項目，檔案內容未變，不必重寫
+            entry.frame = None
+            self.counts['spilled'] += 1
+            return None
+        entry.spilling = True
+        return entry, entry.frame, os.path.join(self.directory, f"{uuid.uuid4().hex}.parquet")
+
+    def _write(self, pending):
+        """在鎖外把標記的項目寫成 Parquet，寫完才釋放記憶體；寫出期間仍可從記憶體讀取"""
+        for entry, frame, path in pending:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                frame.to_parquet(path)
+            except Exception:
+                # 寫不出去時留在記憶體，下次超過預算或閒置時再試
+                with self._lock:
+                    entry.spilling = False
+                self._remove_path(path)
+                continue
+            with self._lock:
+                entry.spilling = False
+                if entry.removed:
+                    stale = path
+                else:
+                    stale = None
+                    entry.path = path
+                    entry.frame = None
+                    self.counts['spilled'] += 1
+            if stale is not None:
+                self._remove_path(stale)
+
+    def _remove(self, entry):
+        """項目被取代或刪除；須持有鎖。正在寫出的檔案由 _write 寫完後刪除"""
+        entry.removed = True
+        if entry.path is not None:
+            self._remove_path(entry.path)
+
+    @staticmethod
+    def _remove_path(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""以串流方式讀取 sitemap / sitemap index（可為 .gz），邊解析邊產出去除重複的網址"""
+
+import gzip
+import io
+import os
+from contextlib import nullcontext
+from urllib.parse import urljoin, urlsplit
+from xml.etree import ElementTree
+
+from pagespeed_cache import normalize_url
+
+DEFAULT_MAX_DEPTH = 3
+DEFAULT_TIMEOUT = 60
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def is_remote(location):
+    return urlsplit(str(location)).scheme in ('http', 'https')
+
+
+def _maybe_gunzip(stream):
+    """依檔頭判斷是否為 gzip，是則包成解壓縮串流"""
+    if stream.seekable():
+        magic = stream.read(2)
+        stream.seek(-len(magic), io.SEEK_CUR)
+    else:
+        stream = io.BufferedReader(stream)
+        magic = stream.peek(2)[:2]
+    if magic == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def open_location(location, timeout=DEFAULT_TIMEOUT):
+    """開啟本機路徑或 http(s) 網址，回傳二進位串流"""
+    if is_remote(location):
+        # 與 PageSpeed 查詢共用 keep-alive 連線池
+        from pagespeed_api import get_session
+
+        response = get_session().get(location, stream=True, timeout=timeout)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        # 讀到結尾時不自動關閉，才能當一般的檔案物件使用
+        response.raw.auto_close = False
+        return response.raw
+    return open(location, 'rb')
+
+
+class SitemapReader:
+    """逐一產出 sitemap 中的網址；遇到 sitemap index 會依序展開子 sitemap
+
+    uploaded_files 為 {檔名: 檔案物件}，子 sitemap 的檔名相符時優先使用上傳的檔案。
+    只有最上層來源是本機路徑時，才允許子 sitemap 指向本機路徑，避免上傳的檔案讀取伺服器上的檔案。
+    """
+
+    def __init__(self, uploaded_files=None, max_depth=DEFAULT_MAX_DEPTH, limit=None, timeout=DEFAULT_TIMEOUT):
+        self.uploaded_files = dict(uploaded_files or {})
+        self.max_depth = max_depth
+        self.limit = limit
+        self.timeout = timeout
+        self.seen = set()
+        self.duplicates = 0
+        self.sitemaps = 0
+        self.errors = []
+        # 已經當作子 sitemap 讀過的上傳檔案，不再當作最上層來源重複讀取
+        self.parsed = set()
+
+    def iter_sources(self, sources):
+        """依序讀取多個來源（路徑、網址或具 name 屬性的檔案物件），跨來源去除重複"""
+        for source in sources:
+            name = getattr(source, 'name', None)
+            if name is not None and name in self.parsed:
+                continue
+            yield from self.iter_urls(source, name=name)
+            if self.limit and len(self.seen) >= self.limit:
+                return
+
+    def iter_urls(self, source, name=None):
+        """source 可為本機路徑、http(s) 網址或已開啟的檔案物件"""
+        if hasattr(source, 'read'):
+            # 呼叫端傳入的檔案物件不由這裡關閉
+            if name is not None:
+                self.parsed.add(name)
+            source.seek(0)
+            yield from self._parse(source, name, False, depth=0, owned=False)
+        else:
+            stream = open_location(source, self.timeout)
+            yield from self._parse(stream, source, not is_remote(source), depth=0)
+
+    def _open_child(self, location, base, allow_local):
+        file_name = os.path.basename(urlsplit(location).path)
+        if file_name in self.uploaded_files:
+            if file_name in self.parsed:
+                return None
+            self.parsed.add(file_name)
+            uploaded = self.uploaded_files[file_name]
+            uploaded.seek(0)
+            return uploaded, file_name, False, False
+        if is_remote(location):
+            return open_location(location, self.timeout), location, False, True
+        if base and is_remote(base):
+            location = urljoin(base, location)
+            return open_location(location, self.timeout), location, False, True
+        if not allow_local:
+            raise ValueError(f"無法取得子 sitemap：{location}")
+        if base and not os.path.isabs(location):
+            location = os.path.join(os.path.dirname(base), location)
+        return open_location(location, self.timeout), location, True, True
+
+    def _parse(self, stream, base, allow_local, depth, owned=True):
+        self.sitemaps += 1
+        root = None
+        with stream if owned else nullcontext(stream):
+            for event, element in ElementTree.iterparse(_maybe_gunzip(stream), events=('start', 'end')):
+                if root is None:
+                    root = element
+                if event != 'end':
+                    continue
+                tag = _local_name(element.tag)
+                if tag not in ('url', 'sitemap'):
+                    continue
+                location = next((child.text.strip() for child in element
+                                 if _local_name(child.tag) == 'loc' and child.text), None)
+                # 處理完即清除，已解析的節點不會留在記憶體中
+                element.clear()
+                root.clear()
+                if not location:
+                    continue
+                if tag == 'url':
+                    key = normalize_url(location)
+                    if key in self.seen:
+                        self.duplicates += 1
+                        continue
+                    self.seen.add(key)
+                    yield location
+                    if self.limit and len(self.seen) >= self.limit:
+                        return
+                elif depth < self.max_depth:
+                    try:
+                        opened = self._open_child(location, base, allow_local)
+                    except Exception as e:
+                        self.errors.append((location, str(e)))
+                        continue
+                    if opened is None:
+                        continue
+                    child, child_base, child_local, child_owned = opened
+                    yield from self._parse(child, child_base, child_local, depth + 1, child_owned)
+                    if self.limit and len(self.seen) >= self.limit:
+                        return
+
+
+def iter_sitemap_urls(sources, uploaded_files=None, limit=None):
+    """依序讀取多個 sitemap 來源，跨來源去除重複"""
+    return SitemapReader(uploaded_files=uploaded_files, limit=limit).iter_sources(sources)
+
+
+def is_sitemap_location(location):
+    """依名稱判斷是否為 sitemap（.xml 或 .xml.gz）"""
+    path = urlsplit(str(location)).path.lower()
+    return path.endswith(('.xml', '.xml.gz'))
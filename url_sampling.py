@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""查詢前的網址前處理：正規化去重、依路徑樣板分組，以及每組抽樣與分組估計"""
+
+import hashlib
+import re
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import pandas as pd
+
+from pagespeed_api import METRIC_FIELDS, SCORE_FIELDS
+from pagespeed_cache import normalize_url
+
+# 不影響頁面內容的追蹤參數
+TRACKING_PARAMS = {'gclid', 'gbraid', 'wbraid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'twclid', 'ttclid',
+                   'mc_cid', 'mc_eid', '_ga', '_gl', 'igshid', 'ref', 'ref_src', 'spm'}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_', 'hsa_')
+# 同一層路徑下有這麼多個不同名稱時，視為同一個樣板（例如商品頁的 slug）
+DEFAULT_MIN_SIBLINGS = 20
+
+_NUMBER = re.compile(r'^\d+$')
+_HASH = re.compile(r'^(?=.*\d)[0-9a-f]{8,}$|^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.I)
+_DATE = re.compile(r'^\d{4}-\d{2}(-\d{2})?$')
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url):
+    """去除追蹤參數與結尾斜線並排序查詢參數，其餘與 normalize_url 相同"""
+    parts = urlsplit(normalize_url(url))
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not is_tracking_param(name))
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme, parts.netloc, path, urlencode(query), ''))
+
+
+def _segment_pattern(segment):
+    if _NUMBER.match(segment):
+        return '{n}'
+    if _DATE.match(segment):
+        return '{date}'
+    if _HASH.match(segment):
+        return '{hash}'
+    return segment
+
+
+def path_template(url):
+    """以路徑樣板表示網址：數字、日期、雜湊等變動的路徑片段以佔位符取代，忽略查詢參數"""
+    parts = urlsplit(url)
+    segments = [_segment_pattern(segment) for segment in parts.path.split('/') if segment]
+    return parts.netloc + '/' + '/'.join(segments)
+
+
+def group_templates(urls, min_siblings=DEFAULT_MIN_SIBLINGS):
+    """回傳每個網址的樣板；同一個上層樣板下的最後一段有 min_siblings 種以上時合併為 {slug}"""
+    templates = [path_template(url) for url in urls]
+    if not min_siblings:
+        return templates
+    children = defaultdict(set)
+    for template in templates:
+        parent, _, leaf = template.rpartition('/')
+        if not leaf.startswith('{'):
+            children[parent].add(leaf)
+    collapsed = {parent for parent, leaves in children.items() if len(leaves) >= min_siblings}
+    grouped = []
+    for template in templates:
+        parent, _, leaf = template.rpartition('/')
+        if parent in collapsed and not leaf.startswith('{'):
+            template = parent + '/{slug}'
+        grouped.append(template)
+    return grouped
+
+
+def _sample_order(url, seed):
+    # 以雜湊值排序，同一批網址每次抽到相同的樣本，歷史趨勢才能比較
+    return hashlib.sha1(f"{seed}:{url}".encode('utf-8')).hexdigest()
+
+
+class SamplePlan:
+    """一次查詢的前處理結果
+
+    frame 每個不重複的網址一列：url（第一次出現的原始網址）、canonical_url、group、
+    group_size 與 sampled；duplicates 為去重時略過的網址數。
+    """
+
+    def __init__(self, frame, input_count, per_group):
+        self.frame = frame
+        self.input_count = input_count
+        self.per_group = per_group
+
+    @property
+    def duplicates(self):
+        return self.input_count - len(self.frame)
+
+    @property
+    def groups(self):
+        return self.frame['group'].nunique()
+
+    @property
+    def sampled_urls(self):
+        return self.frame.loc[self.frame['sampled'], 'url'].tolist()
+
+    def summary(self):
+        """每組的網址數與抽樣數，依網址數由多到少排序"""
+        summary = self.frame.groupby('group', sort=False).agg(urls=('url', 'size'), sampled=('sampled', 'sum'))
+        return summary.sort_values('urls', ascending=False).reset_index()
+
+    def describe(self):
+        return (f"共 {self.input_count} 個網址，去除重複 {self.duplicates} 個，分成 {self.groups} 個樣板，"
+                f"將查詢 {int(self.frame['sampled'].sum())} 個")
+
+    def estimates(self, results):
+        """以各組已查詢的樣本估計整組的分數：平均值套用到整組，並列出樣本的最低分數
+
+        results 為查詢結果（DataFrame 或 dict 清單，可為查詢矩陣的寬表），以正規化後的網址對應回各組。
+        """
+        results = pd.DataFrame(results)
+        # 查詢矩陣的寬表欄位帶有組合後綴，例如 performance_desktop
+        fields = list(SCORE_FIELDS) + list(METRIC_FIELDS)
+        value_columns = [column for column in results
+                         if column in fields or column.startswith(tuple(f"{field}_" for field in fields))]
+        summary = self.summary().set_index('group')
+        if results.empty or not value_columns:
+            summary['audited'] = 0
+            return summary.reset_index()
+
+        results = results.assign(canonical_url=results['url'].map(canonicalize_url))
+        groups = self.frame.drop_duplicates('canonical_url').set_index('canonical_url')['group']
+        results['group'] = results['canonical_url'].map(groups)
+        results[value_columns] = results[value_columns].apply(pd.to_numeric, errors='coerce')
+        grouped = results.dropna(subset=['group']).groupby('group')
+
+        estimates = grouped[value_columns].mean().add_suffix('_mean')
+        if 'performance' in value_columns:
+            estimates['performance_min'] = grouped['performance'].min()
+        estimates.insert(0, 'audited', grouped.size())
+        estimates = summary.join(estimates)
+        estimates['audited'] = estimates['audited'].fillna(0).astype(int)
+        estimates['coverage'] = (estimates['audited'] / estimates['urls']).round(4)
+        return estimates.reset_index()
+
+
+def plan_sample(urls, per_group=0, min_siblings=DEFAULT_MIN_SIBLINGS, seed=0):
+    """正規化並去重 urls，依樣板分組後每組抽出 per_group 個（0 表示全部查詢）"""
+    urls = [str(url).strip() for url in urls if str(url).strip()]
+    first_seen = {}
+    for url in urls:
+        first_seen.setdefault(canonicalize_url(url), url)
+    canonical_urls = list(first_seen)
+    groups = group_templates(canonical_urls, min_siblings=min_siblings)
+    sizes = Counter(groups)
+
+    sampled = [True] * len(canonical_urls)
+    if per_group:
+        members = defaultdict(list)
+        for i, group in enumerate(groups):
+            members[group].append(i)
+        for indexes in members.values():
+            if len(indexes) > per_group:
+                keep = set(sorted(indexes, key=lambda i: _sample_order(canonical_urls[i], seed))[:per_group])
+                for i in indexes:
+                    sampled[i] = i in keep
+
+    frame = pd.DataFrame({
+        'url': list(first_seen.values()),
+        'canonical_url': canonical_urls,
+        'group': groups,
+        'group_size': [sizes[group] for group in groups],
+        'sampled': sampled,
+    })
+    return SamplePlan(frame, len(urls), per_group)
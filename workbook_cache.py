@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""上傳活頁簿的解析快取：依檔案內容雜湊，跨 rerun 只解析一次"""
+
+import hashlib
+import threading
+import zipfile
+from collections import OrderedDict
+from io import BytesIO
+from xml.etree import ElementTree
+
+import pandas as pd
+
+from perf_metrics import METRICS
+from results_buffer import frame_nbytes
+
+DEFAULT_MAX_ENTRIES = 16
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_PREVIEW_ROWS = 5
+
+_SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_sheet_names(data):
+    """只讀取活頁簿的中繼資料取得工作表名稱，不解析任何儲存格
+
+    .xlsx 直接解析壓縮檔內的 xl/workbook.xml；其他格式（如 .xls）改用 pandas。
+    """
+    if zipfile.is_zipfile(BytesIO(data)):
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            with archive.open('xl/workbook.xml') as workbook_xml:
+                return [
+                    element.get('name')
+                    for _, element in ElementTree.iterparse(workbook_xml)
+                    if element.tag == _SPREADSHEET_NS + 'sheet'
+                ]
+    return pd.ExcelFile(BytesIO(data)).sheet_names
+
+
+def read_preview(data, sheet_name, nrows=DEFAULT_PREVIEW_ROWS):
+    """只讀取工作表的前 nrows 列（openpyxl 唯讀模式，讀到足夠列數即停止）"""
+    return pd.read_excel(BytesIO(data), sheet_name=sheet_name, nrows=nrows)
+
+
+class WorkbookCache:
+    """以內容雜湊為鍵，保存工作表名稱與各工作表的 DataFrame，
+    項目數超過 max_entries 或 DataFrame 總大小超過 max_bytes 時淘汰最久未使用的項目
+
+    回傳的 DataFrame 為共用物件，呼叫端不應直接修改。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._sizes = {}
+        # 同一份上傳檔案（file_id + 大小）只計算一次雜湊
+        self._digests = {}
+
+    def digest(self, uploaded_file):
+        """取得上傳檔案的內容雜湊"""
+        file_id = getattr(uploaded_file, 'file_id', None)
+        memo_key = (file_id, getattr(uploaded_file, 'size', None)) if file_id else None
+        if memo_key is not None and memo_key in self._digests:
+            return self._digests[memo_key]
+        digest = content_hash(uploaded_file.getvalue())
+        if memo_key is not None:
+            if len(self._digests) >= self.max_entries * 4:
+                self._digests.clear()
+            self._digests[memo_key] = digest
+        return digest
+
+    def _get_or_load(self, key, load):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        with METRICS.timer('workbook_ingest_seconds'):
+            value = load()
+        size = frame_nbytes(value) if isinstance(value, pd.DataFrame) else 0
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            # 剛載入的項目即使單獨超過 max_bytes 也保留
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                              or sum(self._sizes.values()) > self.max_bytes):
+                evicted, _ = self._entries.popitem(last=False)
+                del self._sizes[evicted]
+        return value
+
+    def sheet_names(self, uploaded_file):
+        """取得活頁簿的工作表名稱"""
+        digest = self.digest(uploaded_file)
+        return self._get_or_load(
+            (digest, 'sheet_names'),
+            lambda: read_sheet_names(uploaded_file.getvalue())
+        )
+
+    def preview(self, uploaded_file, sheet_name, nrows=DEFAULT_PREVIEW_ROWS):
+        """讀取工作表前 nrows 列作為預覽；若整張工作表已在快取中則直接取用"""
+        digest = self.digest(uploaded_file)
+        with self._lock:
+            full = self._entries.get((digest, 'sheet', sheet_name))
+        if full is not None:
+            return full.head(nrows)
+        return self._get_or_load(
+            (digest, 'preview', sheet_name, nrows),
+            lambda: read_preview(uploaded_file.getvalue(), sheet_name, nrows)
+        )
+
+    def read_sheet(self, uploaded_file, sheet_name):
+        """讀取整張工作表"""
+        digest = self.digest(uploaded_file)
+        return self._get_or_load(
+            (digest, 'sheet', sheet_name),
+            lambda: pd.read_excel(BytesIO(uploaded_file.getvalue()), sheet_name=sheet_name)
+        )